@@ -0,0 +1,140 @@
+import bisect
+from typing import List, Sequence, Tuple, Union
+
+from Flashing.segment_image import SegmentImage, as_image
+
+# Erased flash reads back as 0xFF, so filling gaps with it leaves the
+# programmed content unchanged
+DEFAULT_FILL = 0xFF
+
+SectorMap = Union[int, Sequence[Tuple[int, int]], None]
+
+
+class BlockPlannerError(Exception):
+    pass
+
+
+class _Sectors:
+    """Sector lookup: a uniform sector size or an explicit (start, size) map."""
+
+    def __init__(self, sectors: SectorMap):
+        self.size = 0
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        if isinstance(sectors, int):
+            if sectors < 0:
+                raise BlockPlannerError(f"Invalid sector size {sectors}")
+            self.size = sectors
+        elif sectors:
+            for start, size in sorted(sectors):
+                if size <= 0:
+                    raise BlockPlannerError(f"Invalid sector size at 0x{start:08X}")
+                if self.ends and start < self.ends[-1]:
+                    raise BlockPlannerError(f"Overlapping sector at 0x{start:08X}")
+                self.starts.append(start)
+                self.ends.append(start + size)
+
+    def align(self, start: int, end: int) -> Tuple[int, int]:
+        """Widen [start, end) to whole sectors; addresses outside the map stay."""
+        if self.size:
+            return (
+                start - start % self.size,
+                end + (-end) % self.size,
+            )
+        if not self.starts:
+            return start, end
+        i = bisect.bisect_right(self.starts, start) - 1
+        if i >= 0 and start < self.ends[i]:
+            start = self.starts[i]
+        j = bisect.bisect_right(self.starts, end - 1) - 1
+        if j >= 0 and end - 1 < self.ends[j]:
+            end = self.ends[j]
+        return start, end
+
+
+def plan_ranges(
+    blocks: Sequence[Tuple[int, int]], max_gap: int = 0, sectors: SectorMap = None
+) -> List[Tuple[int, int]]:
+    """
+    Merge (start, length) blocks whose gap is at most max_gap bytes, widen
+    them to the sector map and merge again where sectors are shared (an
+    erase must never cover another block's sector).
+    """
+    if max_gap < 0:
+        raise BlockPlannerError(f"Invalid gap threshold {max_gap}")
+    lookup = _Sectors(sectors)
+    planned: List[List[int]] = []
+    for start, length in sorted(blocks):
+        start, end = lookup.align(start, start + length)
+        if planned and start - planned[-1][1] <= max_gap:
+            planned[-1][1] = max(planned[-1][1], end)
+        else:
+            planned.append([start, end])
+    return [(s, e - s) for s, e in planned]
+
+
+def plan_blocks(
+    image,
+    max_gap: int = 0,
+    fill: int = DEFAULT_FILL,
+    sectors: SectorMap = None,
+) -> SegmentImage:
+    """
+    Image whose blocks are the planned ranges, with every byte not in the
+    firmware set to fill. The firmware bytes themselves are unchanged; only
+    the number of erase/download/validate cycles drops. Returns the image
+    itself when planning changes nothing.
+    """
+    image = as_image(image)
+    if not 0 <= fill <= 0xFF:
+        raise BlockPlannerError(f"Invalid fill byte {fill}")
+    blocks = image.blocks()
+    ranges = plan_ranges(blocks, max_gap, sectors)
+    if ranges == blocks:
+        return image
+
+    planned = SegmentImage()
+    for start, length in ranges:
+        run = bytearray([fill]) * length
+        for seg_start, seg in image.segments:
+            if seg_start >= start + length:
+                break
+            if seg_start + len(seg) <= start:
+                continue
+            run[seg_start - start : seg_start - start + len(seg)] = seg
+        planned.write(start, run)
+    print(
+        f"[INFO] Block plan: {len(blocks)} segment(s) -> {len(ranges)} block(s), "
+        f"{sum(n for _, n in ranges) - len(image)} fill byte(s)"
+    )
+    return planned
+
+
+def parse_sector_map(text: str) -> SectorMap:
+    """
+    Sector map from a config string: a uniform size ("0x1000") or
+    comma-separated start:size pairs ("0xFF200000:0x8000, 0xFF208000:0x8000").
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
+    try:
+        if ":" not in text:
+            return int(text, 0)
+        sectors = []
+        for item in text.split(","):
+            start, _, size = item.strip().partition(":")
+            sectors.append((int(start, 0), int(size, 0)))
+        return sectors
+    except ValueError as e:
+        raise BlockPlannerError(f"Invalid sector map '{text}': {e}")
+
+
+def plan_from_config(image, config: dict) -> SegmentImage:
+    """plan_blocks() with station.ini style settings (all optional)."""
+    return plan_blocks(
+        image,
+        max_gap=int(config.get("block_merge_gap", "0"), 0),
+        fill=int(config.get("block_fill", "0xFF"), 0),
+        sectors=parse_sector_map(config.get("sector_map", "")),
+    )
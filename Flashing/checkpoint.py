@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Optional
+
+CHECKPOINT_DIRNAME = "flash_checkpoints"
+# Journals older than this are ignored: the vehicle may have been reworked
+CHECKPOINT_MAX_AGE_S = 24 * 3600
+# ECU Serial Number, read to tell a swapped ECU from the journaled one
+DID_ECU_SERIAL_NUMBER = 0xF18C
+
+
+def image_id(image) -> str:
+    """
+    Identity of the firmware being flashed: the cache digest when the image
+    came from image_cache, otherwise a hash of its block layout and CRCs.
+    """
+    digest = getattr(image, "digest", None)
+    if digest:
+        return digest
+    h = hashlib.sha256()
+    for start, length in image.blocks():
+        crc = image.block_crc(start, length)
+        h.update(f"{start:08X}:{length:X}:{crc:04X};".encode("ascii"))
+    return h.hexdigest()
+
+
+def read_ecu_id(uds) -> Optional[str]:
+    """ECU serial number (0xF18C) as hex, None when the ECU does not answer."""
+    data = uds.read_data_by_identifier(DID_ECU_SERIAL_NUMBER)
+    if not data or data[:2] != DID_ECU_SERIAL_NUMBER.to_bytes(2, "big"):
+        return None
+    return data[2:].hex().upper()
+
+
+class FlashCheckpoint:
+    """
+    Per-VIN journal of the blocks that passed flashing_done validation for
+    one firmware image. program() skips journaled blocks, so a retry after an
+    interrupted cycle resumes at the first unverified block. The journal is
+    removed once the whole image is programmed, and ignored when it was
+    written for another image, for another ECU (see bind_ecu()) or more
+    than CHECKPOINT_MAX_AGE_S ago.
+    """
+
+    def __init__(self, vin: str, image, directory: str = CHECKPOINT_DIRNAME):
+        self.vin = vin
+        self.image = image_id(image)
+        safe_vin = re.sub(r"[^A-Za-z0-9_-]", "_", vin) or "unknown"
+        self.path = os.path.join(directory, f"{safe_vin}.json")
+        self.verified = set()
+        self.ecu = None
+        self.created = time.time()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                journal = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Checkpoint {self.path} unreadable, starting over: {e}")
+            return
+        if journal.get("vin") != self.vin or journal.get("image") != self.image:
+            # another firmware was being flashed: nothing carries over
+            return
+        created = journal.get("created", 0)
+        if not 0 <= time.time() - created <= CHECKPOINT_MAX_AGE_S:
+            print(f"[INFO] Checkpoint {self.path} expired, starting over")
+            return
+        self.created = created
+        self.ecu = journal.get("ecu")
+        self.verified = {tuple(entry) for entry in journal.get("verified", [])}
+        if self.verified:
+            print(
+                f"[INFO] Resuming {self.vin}: {len(self.verified)} block(s) "
+                f"already verified"
+            )
+
+    def _save(self):
+        journal = {
+            "vin": self.vin,
+            "image": self.image,
+            "ecu": self.ecu,
+            "created": self.created,
+            "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "verified": sorted(self.verified),
+        }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(journal, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def bind_ecu(self, ecu_id: Optional[str]):
+        """
+        Tie the journal to the ECU on the bus (None: no serial number).
+        Blocks journaled for another ECU are dropped.
+        """
+        if self.verified and ecu_id != self.ecu:
+            print(
+                f"[INFO] Checkpoint for {self.vin} was written for another ECU, "
+                f"starting over"
+            )
+            self.verified.clear()
+        self.ecu = ecu_id
+
+    def is_verified(self, address: int, length: int, crc: int) -> bool:
+        return (address, length, crc) in self.verified
+
+    def mark_verified(self, address: int, length: int, crc: int):
+        self.verified.add((address, length, crc))
+        try:
+            self._save()
+        except OSError as e:
+            print(f"[WARN] Checkpoint not saved: {e}")
+
+    def forget(self, address: int, length: int, crc: int):
+        self.verified.discard((address, length, crc))
+        try:
+            self._save()
+        except OSError as e:
+            print(f"[WARN] Checkpoint not saved: {e}")
+
+    def clear(self):
+        self.verified.clear()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[WARN] Checkpoint not removed: {e}")
+
+
+def open_checkpoint(vin: Optional[str], image, directory: str = CHECKPOINT_DIRNAME):
+    """FlashCheckpoint for vin, or None when no VIN is known."""
+    if not vin:
+        return None
+    return FlashCheckpoint(vin, image, directory)
@@ -0,0 +1,73 @@
+import lzma
+import zlib
+from typing import Callable, Dict, Optional, Tuple
+
+from Flashing.segment_image import SegmentImage
+
+# name -> (compressionMethod nibble of the 0x34 dataFormatIdentifier,
+#          compress, decompress). Method ids are bootloader specific: add or
+#          renumber with register_compression()
+COMPRESSION_METHODS: Dict[str, Tuple[int, Callable, Callable]] = {
+    "zlib": (0x1, lambda data: zlib.compress(data, 9), zlib.decompress),
+    "lzma": (0x2, lzma.compress, lzma.decompress),
+}
+
+
+class CompressionError(Exception):
+    pass
+
+
+def require(ok, msg: str):
+    """Raise on falsy result; return the value otherwise."""
+    if not ok:
+        raise CompressionError(msg)
+    return ok
+
+
+def register_compression(
+    name: str, method_id: int, compress: Callable, decompress: Callable
+):
+    """Add (or replace) a compression method."""
+    require(0 < method_id <= 0x0F, f"Invalid compression method id {method_id}")
+    COMPRESSION_METHODS[name.lower()] = (method_id, compress, decompress)
+
+
+def method(name: str) -> Tuple[int, Callable, Callable]:
+    return require(
+        COMPRESSION_METHODS.get((name or "").strip().lower()),
+        f"Unknown compression method '{name}'",
+    )
+
+
+def data_format(name: Optional[str]) -> int:
+    """0x34 dataFormatIdentifier for a method (no encryption); 0x00 for None."""
+    return method(name)[0] << 4 if name else 0x00
+
+
+def decompressor(data_format_id: int) -> Optional[Callable]:
+    """Decompress function for a dataFormatIdentifier; None if unknown."""
+    if data_format_id & 0x0F:
+        return None  # encrypted
+    for method_id, _, decompress in COMPRESSION_METHODS.values():
+        if method_id == data_format_id >> 4:
+            return decompress
+    return None
+
+
+def block_bytes(image: SegmentImage, start_addr: int, length: int) -> bytes:
+    return b"".join(image.iter_chunks(start_addr, length, max(1, length)))
+
+
+def compress_block(
+    image: SegmentImage, start_addr: int, length: int, name: str
+) -> Optional[bytes]:
+    """
+    Compressed payload of one block, kept in image.compressed. None when the
+    block does not get smaller; it is then downloaded as is.
+    """
+    key = (name.strip().lower(), start_addr, length)
+    if key not in image.compressed:
+        data = block_bytes(image, start_addr, length)
+        payload = method(name)[1](data)
+        image.compressed[key] = payload if len(payload) < len(data) else None
+    return image.compressed[key]
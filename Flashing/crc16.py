@@ -0,0 +1,63 @@
+import binascii
+
+# CRC-16 used by the bootloader's 0xFF01 validate routine: reflected
+# polynomial 0x8408 (CCITT), initial value 0x0000, no final XOR.
+POLY = 0x8408
+
+
+def _make_table(poly: int = POLY) -> tuple:
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ poly if crc & 0x0001 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+CRC_TABLE = _make_table()
+
+# Bit-reversal of every byte value. Reflecting input and register turns this
+# CRC into binascii.crc_hqx (poly 0x1021), which runs in C.
+_REV8 = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def _rev16(value: int) -> int:
+    return (_REV8[value & 0xFF] << 8) | _REV8[value >> 8]
+
+
+def crc16_ccitt_8408_table(data, initial: int = 0x0000) -> int:
+    """Pure-Python 256-entry table implementation (one lookup per byte)."""
+    crc = initial
+    table = CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc & 0xFFFF
+
+
+def crc16_ccitt_8408(data, initial: int = 0x0000) -> int:
+    """
+    CRC-16/0x8408 of data (bytes, bytearray or memoryview), continuing from
+    initial so a block can be fed in pieces.
+    """
+    reflected = bytes(data).translate(_REV8)
+    return _rev16(binascii.crc_hqx(reflected, _rev16(initial & 0xFFFF)))
+
+
+class Crc16:
+    """Incremental CRC-16/0x8408: update() with pieces, read .value."""
+
+    def __init__(self, initial: int = 0x0000):
+        self.value = initial & 0xFFFF
+
+    def update(self, data) -> "Crc16":
+        self.value = crc16_ccitt_8408(data, self.value)
+        return self
+
+
+def block_crc(image, start_addr: int, length: int) -> int:
+    """CRC of one flash block of a SegmentImage, as the ECU computes it."""
+    crc = Crc16()
+    for chunk in image.iter_chunks(start_addr, length, 1 << 16):
+        crc.update(chunk)
+    return crc.value
@@ -1,7 +1,9 @@
-import time
-import can
 from typing import List, Tuple
 
+from Flashing.block_planner import DEFAULT_FILL, BlockPlannerError, plan_blocks
+from Flashing.firmware_formats import FirmwareFormatError
+from Flashing.segment_image import SegmentImageError
+
 
 # --- helpers (match your existing pattern) ---
 class FindAddrLenError(Exception):
@@ -17,69 +19,21 @@ def require(ok, msg: str):
 # --------------------------------------------
 
 
-def find_addr_len(mot_file_path):
+def find_addr_len(mot_file_path, max_gap=0, fill=DEFAULT_FILL, sectors=None):
 
     try:
-        mem = {}
-
-        # Open as strict ASCII; S-records are ASCII by spec
-        with open(mot_file_path, "r", encoding="ascii", errors="strict") as f:
-            for lineno, line in enumerate(f, 1):
-                line = line.strip()
-                if not line or line[0] != "S":
-                    continue
-
-                rectype = line[1]
-                if rectype not in ("1", "2", "3"):
-                    # Only consider data records
-                    continue
-
-                hexpart = line[2:]
-                try:
-                    payload = bytes.fromhex(hexpart)
-                except ValueError as e:
-                    raise FindAddrLenError(f"Line {lineno}: invalid hex — {e}")
-
-                addr_len_map = {"1": 2, "2": 3, "3": 4}
-                alen = addr_len_map[rectype]
-
-                # payload layout: [count][addr...][data...][checksum]
-                require(
-                    len(payload) >= 1 + alen + 1,
-                    f"Line {lineno}: S{rectype} too short (len={len(payload)})",
-                )
-
-                addr = int.from_bytes(payload[1 : 1 + alen], "big")
-                data = payload[1 + alen : -1]  # exclude checksum (no validation here)
-
-                # Accumulate bytes into memory map
-                for i, b in enumerate(data):
-                    mem[addr + i] = b
-
-        if not mem:
-            return []
-
-        # Build contiguous blocks
-        addrs = sorted(mem.keys())
-        blocks: List[Tuple[int, int]] = []
-        start = addrs[0]
-        prev = start
-
-        for a in addrs[1:]:
-            if a == prev + 1:
-                prev = a
-                continue
-            # close previous block
-            blocks.append((start, prev - start + 1))
-            start = a
-            prev = a
+        # Accepts a firmware path (.mot/.hex/.vbf) or an already loaded SegmentImage; segments
+        # closer than max_gap are merged and blocks widened to sectors
+        image = plan_blocks(mot_file_path, max_gap, fill, sectors)
 
-        # close final block
-        blocks.append((start, prev - start + 1))
+        # Contiguous blocks fall straight out of the merged segment runs
+        blocks: List[Tuple[int, int]] = image.blocks()
         print(blocks)
         return blocks
 
-    except FindAddrLenError as e:
+    except (
+        FindAddrLenError, SegmentImageError, FirmwareFormatError, BlockPlannerError
+    ) as e:
         print(f"[FAIL] {e}")
         return False
     except Exception as e:
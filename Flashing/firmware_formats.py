@@ -0,0 +1,222 @@
+import binascii
+import os
+import re
+import zlib
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from Flashing.segment_image import SegmentImage, load_srec
+
+# Raw binaries are read and merged in pieces of this size
+BIN_READ_SIZE = 1 << 20
+
+
+class FirmwareFormatError(Exception):
+    pass
+
+
+def require(ok, msg: str):
+    """Raise on falsy result; return the value otherwise."""
+    if not ok:
+        raise FirmwareFormatError(msg)
+    return ok
+
+
+# ── Intel HEX ────────────────────────────────────────────────────
+def load_ihex(path: str) -> SegmentImage:
+    """
+    Parse an Intel HEX file in one pass. Data records are placed with the
+    extended segment (02) / extended linear (04) base in effect; start
+    address records (03, 05) carry no data and are ignored.
+    """
+    image = SegmentImage()
+    base = 0
+    with open(path, "r", encoding="ascii", errors="strict") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line[0] != ":":
+                continue
+            try:
+                record = bytes.fromhex(line[1:])
+            except ValueError as e:
+                raise FirmwareFormatError(f"Line {lineno}: invalid hex — {e}")
+
+            # record layout: [count][addr hi][addr lo][type][data...][checksum]
+            require(
+                len(record) >= 5 and len(record) == record[0] + 5,
+                f"Line {lineno}: record length does not match its byte count",
+            )
+            require(sum(record) & 0xFF == 0, f"Line {lineno}: checksum error")
+            rectype = record[3]
+            if rectype == 0x00:
+                image.write(base + ((record[1] << 8) | record[2]), record[4:-1])
+            elif rectype == 0x01:
+                break
+            elif rectype == 0x02:
+                base = int.from_bytes(record[4:6], "big") << 4
+            elif rectype == 0x04:
+                base = int.from_bytes(record[4:6], "big") << 16
+    return image
+
+
+# ── raw binary ───────────────────────────────────────────────────
+def load_bin(path: str, base_address: int) -> SegmentImage:
+    """Raw binary: the file contents as one block at base_address."""
+    require(
+        base_address is not None and base_address >= 0,
+        f"{os.path.basename(path)}: raw binary needs a base address",
+    )
+    image = SegmentImage()
+    offset = 0
+    with open(path, "rb") as f:
+        for piece in iter(lambda: f.read(BIN_READ_SIZE), b""):
+            image.write(base_address + offset, piece)
+            offset += len(piece)
+    return image
+
+
+# ── VBF (Versatile Binary Format) ────────────────────────────────
+_VBF_CHECKSUM = re.compile(rb"file_checksum\s*=\s*(0x[0-9A-Fa-f]+|\d+)\s*;")
+
+
+def _vbf_header(f) -> bytes:
+    """
+    Read the ASCII header up to and including the brace closing the
+    `header { ... }` section; strings and comments may contain braces.
+    """
+    header = bytearray()
+    depth = 0
+    state = None  # None, '"', "//" or "/*"
+    prev = 0
+    while True:
+        piece = f.read(4096)
+        require(piece, "VBF header is not terminated")
+        for i, c in enumerate(piece):
+            if state == '"':
+                if c == 0x22 and prev != 0x5C:
+                    state = None
+            elif state == "//":
+                if c == 0x0A:
+                    state = None
+            elif state == "/*":
+                if c == 0x2F and prev == 0x2A:
+                    state = None
+                    c = 0  # "*/" must not start a new "/"
+            elif c == 0x22:
+                state = '"'
+            elif c == 0x2F and prev == 0x2F:
+                state = "//"
+            elif c == 0x2A and prev == 0x2F:
+                state = "/*"
+                c = 0  # "/*/" is not a complete comment
+            elif c == 0x7B:
+                depth += 1
+            elif c == 0x7D:
+                depth -= 1
+                require(depth >= 0, "VBF header has an unbalanced '}'")
+                if depth == 0:
+                    header += piece[: i + 1]
+                    f.seek(i + 1 - len(piece), os.SEEK_CUR)
+                    return bytes(header)
+            prev = c
+        header += piece
+
+
+def load_vbf(path: str) -> SegmentImage:
+    """
+    Parse a VBF file: ASCII header, then binary blocks of
+    [start (4, big endian)][length (4)][data][CRC-16/CCITT-FALSE (2)].
+    Every block CRC and, when the header has one, the file_checksum (CRC-32
+    of the binary section) are checked.
+    """
+    image = SegmentImage()
+    with open(path, "rb") as f:
+        header = _vbf_header(f)
+        require(header.lstrip().startswith(b"vbf_version"), "Not a VBF file")
+        match = _VBF_CHECKSUM.search(header)
+        file_crc = 0
+        while True:
+            head = f.read(8)
+            if not head:
+                break
+            require(len(head) == 8, "VBF block header truncated")
+            start = int.from_bytes(head[:4], "big")
+            length = int.from_bytes(head[4:], "big")
+            data = f.read(length)
+            trailer = f.read(2)
+            require(
+                len(data) == length and len(trailer) == 2,
+                f"VBF block 0x{start:08X} truncated",
+            )
+            require(
+                binascii.crc_hqx(data, 0xFFFF) == int.from_bytes(trailer, "big"),
+                f"VBF block 0x{start:08X}: CRC error",
+            )
+            if match:
+                for part in (head, data, trailer):
+                    file_crc = zlib.crc32(part, file_crc)
+            image.write(start, data)
+    if match:
+        require(
+            file_crc == int(match.group(1), 0),
+            f"VBF file_checksum error (0x{file_crc:08X})",
+        )
+    return image
+
+
+# ── format registry ──────────────────────────────────────────────
+# name -> (loader, needs base address)
+FORMATS: Dict[str, Tuple[Callable[..., SegmentImage], bool]] = {}
+EXTENSIONS: Dict[str, str] = {}
+
+
+def register_format(
+    name: str,
+    loader: Callable[..., SegmentImage],
+    extensions: Iterable[str] = (),
+    needs_base: bool = False,
+):
+    """
+    Make a firmware format available to load_firmware(). loader(path) returns
+    a SegmentImage; with needs_base=True it is called as loader(path,
+    base_address) for formats that carry no addresses.
+    """
+    FORMATS[name] = (loader, needs_base)
+    for ext in extensions:
+        EXTENSIONS[ext.lower()] = name
+
+
+register_format("srec", load_srec, (".mot", ".s19", ".s28", ".s37", ".srec"))
+register_format("ihex", load_ihex, (".hex", ".ihex"))
+register_format("bin", load_bin, (".bin",), needs_base=True)
+register_format("vbf", load_vbf, (".vbf",))
+
+
+def detect_format(path: str) -> str:
+    """Format name from the file extension, else from the first bytes."""
+    name = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if name:
+        return name
+    with open(path, "rb") as f:
+        head = f.read(64).lstrip()
+    if head.startswith(b"vbf_version"):
+        return "vbf"
+    if head[:1] == b"S" and head[1:2].isdigit():
+        return "srec"
+    if head[:1] == b":":
+        return "ihex"
+    raise FirmwareFormatError(f"Unknown firmware format: {os.path.basename(path)}")
+
+
+def load_firmware(
+    path: str, base_address: Optional[int] = None, fmt: Optional[str] = None
+) -> SegmentImage:
+    """
+    Load any registered firmware format into a SegmentImage; fmt overrides
+    detection. base_address is the load address of raw binaries.
+    """
+    fmt = fmt or detect_format(path)
+    entry = require(FORMATS.get(fmt), f"Unknown firmware format '{fmt}'")
+    loader, needs_base = entry
+    if needs_base:
+        return loader(path, base_address)
+    return loader(path)
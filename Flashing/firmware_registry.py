@@ -0,0 +1,186 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from Flashing.block_planner import plan_from_config
+from Flashing.firmware_formats import EXTENSIONS
+from Flashing.image_cache import cache_dir_for, load_cached, precompress
+from Flashing.segment_image import SegmentImage
+from Flashing.sw_check import DID_ECU_SOFTWARE_NUMBER, DID_SPARE_PART_NUMBER
+
+# Optional SKU_File_Mapping.xlsx column naming each SKU's firmware file
+FIRMWARE_COLUMN = "Firmware File"
+# Optional columns with the identification the firmware reports once
+# flashed (see Flashing.sw_check)
+IDENTIFICATION_COLUMNS = {
+    "Software Number": DID_ECU_SOFTWARE_NUMBER,
+    "Part Number": DID_SPARE_PART_NUMBER,
+}
+
+
+class FirmwareRegistryError(Exception):
+    pass
+
+
+def require(ok, msg: str):
+    """Raise on falsy result; return the value otherwise."""
+    if not ok:
+        raise FirmwareRegistryError(msg)
+    return ok
+
+
+def _sheet_columns(mapping_file: str, columns) -> Dict[str, Dict[str, str]]:
+    """SKU -> {column: text} for the given columns of the SKU mapping sheet."""
+    import pandas as pd
+
+    try:
+        df = pd.read_excel(mapping_file)
+    except (OSError, ValueError) as e:
+        print(f"[WARN] SKU mapping {mapping_file} unreadable: {e}")
+        return {}
+    df.columns = df.columns.str.strip()
+    rows = {}
+    for column in columns:
+        if column not in df.columns:
+            continue
+        for sku, value in zip(df["SKU No"], df[column]):
+            if pd.notna(sku) and pd.notna(value) and str(value).strip():
+                rows.setdefault(str(sku).strip(), {})[column] = str(value).strip()
+    return rows
+
+
+def load_sku_firmware_map(mapping_file: str) -> Dict[str, str]:
+    """
+    SKU -> firmware file from the FIRMWARE_COLUMN of the SKU mapping sheet;
+    empty when the sheet or the column is missing.
+    """
+    rows = _sheet_columns(mapping_file, [FIRMWARE_COLUMN])
+    return {sku: row[FIRMWARE_COLUMN] for sku, row in rows.items()}
+
+
+def load_sku_identification_map(mapping_file: str) -> Dict[str, Dict[int, bytes]]:
+    """SKU -> {DID: expected ASCII value} from the IDENTIFICATION_COLUMNS."""
+    rows = _sheet_columns(mapping_file, IDENTIFICATION_COLUMNS)
+    return {
+        sku: {
+            IDENTIFICATION_COLUMNS[column]: text.encode("ascii")
+            for column, text in row.items()
+        }
+        for sku, row in rows.items()
+    }
+
+
+class FirmwareRegistry:
+    """
+    Firmware file for a SKU: the mapping sheet entry, else a file named after
+    the SKU (any firmware_formats extension) in firmware_dir, else the
+    station default. Relative names are resolved against firmware_dir.
+    identification holds, per SKU, the DID values the ECU reports once it
+    runs that firmware.
+    """
+
+    def __init__(
+        self,
+        mapping: Optional[Dict[str, str]] = None,
+        firmware_dir: str = "",
+        default: Optional[str] = None,
+        identification: Optional[Dict[str, Dict[int, bytes]]] = None,
+    ):
+        self.mapping = dict(mapping or {})
+        self.firmware_dir = firmware_dir
+        self.default = default
+        self.identification = dict(identification or {})
+
+    @classmethod
+    def from_config(cls, config: dict, mapping_file: Optional[str] = None):
+        """Registry from station.ini settings (firmware_dir, default_firmware)."""
+        return cls(
+            mapping=load_sku_firmware_map(mapping_file) if mapping_file else None,
+            firmware_dir=config.get("firmware_dir", "").strip(),
+            default=config.get("default_firmware", "").strip() or None,
+            identification=(
+                load_sku_identification_map(mapping_file) if mapping_file else None
+            ),
+        )
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.firmware_dir, name) if self.firmware_dir else name
+
+    def resolve(self, sku: Optional[str]) -> str:
+        sku = (sku or "").strip()
+        if sku in self.mapping:
+            return self._path(self.mapping[sku])
+        if sku and self.firmware_dir and os.path.isdir(self.firmware_dir):
+            for ext in EXTENSIONS:
+                path = self._path(sku + ext)
+                if os.path.isfile(path):
+                    return path
+        return self._path(
+            require(self.default, f"No firmware registered for SKU '{sku}'")
+        )
+
+    def expected_identification(self, sku: Optional[str]) -> Dict[int, bytes]:
+        """{DID: value} of the SKU's target software; empty when unknown."""
+        return dict(self.identification.get((sku or "").strip(), {}))
+
+
+def prepare_image(path: str, config: dict) -> SegmentImage:
+    """
+    Everything flashing needs before the first erase: parsed (or cached)
+    image, block plan from station.ini, the CRC of every planned block and,
+    with compression set, every block compressed for the download.
+    """
+    base = config.get("bin_base_address", "").strip()
+    image = plan_from_config(
+        load_cached(path, base_address=int(base, 0) if base else None), config
+    )
+    image.precompute_crcs()
+    compression = config.get("compression", "").strip()
+    if compression:
+        precompress(image, compression, cache_dir_for(path))
+    return image
+
+
+class FirmwarePrefetcher:
+    """
+    Prepares the firmware for a SKU on a background thread as soon as the SKU
+    is known, so the Flashing step finds the image parsed, planned and
+    CRC-indexed. Only the latest SKU is kept.
+    """
+
+    def __init__(self, registry: FirmwareRegistry, config: dict):
+        self.registry = registry
+        self.config = config
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._sku = None
+        self._future: Optional[Future] = None
+
+    def _prepare(self, sku):
+        path = self.registry.resolve(sku)
+        image = prepare_image(path, self.config)
+        print(f"[INFO] Firmware for SKU {sku} ready: {os.path.basename(path)}")
+        return path, image
+
+    def prefetch(self, sku: Optional[str]) -> Future:
+        """Start preparing sku's firmware (no-op when it already is, unless that failed)."""
+        with self._lock:
+            failed = (
+                self._future is not None
+                and self._future.done()
+                and self._future.exception() is not None
+            )
+            if self._future is None or sku != self._sku or failed:
+                self._sku = sku
+                self._future = self._pool.submit(self._prepare, sku)
+            return self._future
+
+    def get(
+        self, sku: Optional[str], timeout: Optional[float] = None
+    ) -> Tuple[str, SegmentImage]:
+        """(firmware path, prepared image), waiting for a running prefetch."""
+        return self.prefetch(sku).result(timeout)
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
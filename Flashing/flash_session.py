@@ -0,0 +1,407 @@
+import time
+from contextlib import contextmanager
+
+import can
+
+from UDS import UdsHandler
+from Flashing.segment_image import as_image
+
+
+class FlashSession:
+    """
+    One CAN bus and one UdsHandler for the whole programming sequence.
+    Preflashing, flash_setup, flash_chunk, flashing_done and Postflashing all
+    run as steps on the same open bus, and the S3 keep-alive timer carries
+    over between them.
+    """
+
+    def __init__(
+        self,
+        interface: str = "pcan",
+        channel: str = "PCAN_USBBUS1",
+        bitrate: int = 500000,
+        tx_id: int = 0x7E0,
+        rx_id: int = 0x7E8,
+        timings=None,
+        trace=None,
+        fd=False,
+        bus_kwargs=None,
+        frame_len=None,
+    ):
+        self.interface = interface
+        self.channel = channel
+        self.bitrate = bitrate
+        self.tx_id = tx_id
+        self.rx_id = rx_id
+        self.timings = timings or {"P2": 500, "P2*": 5000, "S3": 5000}
+        self.trace = trace  # None: the process-wide UDS trace
+        # CAN FD ECUs: fd=True; data-phase timing goes in bus_kwargs (e.g.
+        # PCAN f_clock_mhz/nom_*/data_* values), passed to can.Bus as is
+        self.fd = fd
+        self.bus_kwargs = dict(bus_kwargs or {})
+        self.frame_len = frame_len  # ISO-TP TX_DL on FD, None: 64
+        self.bus = None
+        self.uds = None
+        self.last_request_time = time.time()
+        # 0x34 dataFormatIdentifiers the ECU refused (see flash_setup)
+        self.rejected_formats = set()
+
+    # ── bus lifetime ─────────────────────────────────────────────
+    def open(self) -> "FlashSession":
+        if self.bus is None:
+            kwargs = dict(self.bus_kwargs)
+            if self.fd:
+                kwargs.setdefault("fd", True)
+            self.bus = can.interface.Bus(
+                interface=self.interface,
+                channel=self.channel,
+                bitrate=self.bitrate,
+                **kwargs,
+            )
+            self.bus.set_filters([{"can_id": self.rx_id, "can_mask": 0x7FF}])
+            self.uds = UdsHandler(
+                self.bus,
+                self.tx_id,
+                self.rx_id,
+                timings=self.timings,
+                trace=self.trace,
+                fd=self.fd,
+                frame_len=self.frame_len,
+            )
+            self.last_request_time = time.time()
+            print(f"[INFO] Flash session opened on {self.channel}")
+        return self
+
+    def close(self):
+        if self.bus is not None:
+            try:
+                self.bus.shutdown()
+            except Exception as e:
+                print(f"[WARN] bus shutdown error: {e}")
+            self.bus = None
+            self.uds = None
+            print(f"[INFO] Flash session closed on {self.channel}")
+
+    def reopen(self, bitrate: int) -> "FlashSession":
+        """Reopen the bus at another bit rate (after a 0x87 link transition)."""
+        self.close()
+        self.bitrate = bitrate
+        return self.open()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ── S3 keep-alive ────────────────────────────────────────────
+    def keep_alive(self):
+        """Call before each request: Tester Present once S3 is half expired."""
+        elapsed_ms = (time.time() - self.last_request_time) * 1000
+        if elapsed_ms >= self.timings["S3"] / 2:
+            if self.uds.tester_present():
+                print("[INFO] Tester Present sent")
+            else:
+                print("[WARN] Tester Present failed or no response")
+        self.last_request_time = time.time()
+
+    # ── programming steps ────────────────────────────────────────
+    def preflash(self):
+        from Flashing.Preflashing import Preflashing
+
+        return Preflashing(session=self)
+
+    def setup(self, address, length, data_format=0x00, transfer_length=None):
+        from Flashing.flash_setup import flash_setup
+
+        return flash_setup(
+            address,
+            length,
+            session=self,
+            data_format=data_format,
+            transfer_length=transfer_length,
+        )
+
+    def chunks(self, image, address, length, chunk_payload_capacity, payload=None):
+        from Flashing.flash_chunk import flash_chunk
+
+        return flash_chunk(
+            image,
+            address,
+            length,
+            chunk_payload_capacity,
+            session=self,
+            payload=payload,
+        )
+
+    def unchanged(self, address, length, crc=None, image=None):
+        from Flashing.flashing_done import block_unchanged
+
+        return block_unchanged(address, length, crc, image=image, session=self)
+
+    def software_current(self, expected):
+        from Flashing.sw_check import software_is_current
+
+        return software_is_current(expected, session=self)
+
+    def done(self, address, length, crc=None, image=None):
+        from Flashing.flashing_done import flashing_done
+
+        return flashing_done(address, length, crc, image=image, session=self)
+
+    def readback(self, image):
+        from Flashing.readback import ReadbackVerifier
+
+        return ReadbackVerifier(image, session=self)
+
+    @contextmanager
+    def link_speed(self, bitrate=None):
+        """
+        Run the block in the with statement at bitrate (0x87 LinkControl)
+        and restore the current rate afterwards. Yields whether the switch
+        took place; None, 0 or the current rate leave the link alone.
+        """
+        from Flashing.link_control import restore_link, switch_link
+
+        original = self.bitrate
+        switched = bool(bitrate) and bitrate != original
+        if switched:
+            switched = switch_link(bitrate, session=self)
+        try:
+            yield switched
+        finally:
+            if switched:
+                restore_link(original, session=self)
+
+    def postflash(self):
+        from Flashing.Postflashing import Postflashing
+
+        return Postflashing(session=self)
+
+    def program(
+        self,
+        image,
+        progress=None,
+        differential=False,
+        checkpoint=None,
+        retries=0,
+        verify=False,
+        compression=None,
+    ):
+        """
+        Erase, download and validate every block of the image.
+        progress(block_index, chunks_done, total_chunks) is called per chunk.
+        With differential=True each block's CRC is first checked by the ECU
+        (0xFF01) and blocks it already holds are not erased or rewritten.
+        A FlashCheckpoint skips blocks verified by an earlier, interrupted
+        attempt on this ECU once the ECU confirms their CRC (0xFF01), and
+        records each block as it passes validation; a failed block is erased
+        and downloaded again up to `retries` times.
+        With verify=True every programmed block is also read back (0x23) and
+        compared with the image; the compare overlaps the next block's
+        erase and download, and a block is journaled only once it matched.
+        compression names a Flashing.compression method: blocks that shrink
+        are downloaded compressed (0x34 dataFormatIdentifier) unless the ECU
+        rejects the format, then everything goes out uncompressed.
+        Returns (success, message).
+        """
+        image = as_image(image)
+        blocks = image.blocks()
+        if not blocks:
+            return False, "No blocks found for flashing"
+
+        if compression:
+            from Flashing.compression import CompressionError, data_format
+
+            try:
+                data_format(compression)
+            except CompressionError as e:
+                print(f"[WARN] {e}, blocks will be downloaded uncompressed")
+                compression = None
+
+        if checkpoint:
+            from Flashing.checkpoint import read_ecu_id
+
+            self.keep_alive()
+            checkpoint.bind_ecu(read_ecu_id(self.uds))
+
+        verifier = self.readback(image) if verify else None
+        try:
+            return self._program_blocks(
+                image,
+                blocks,
+                progress,
+                differential,
+                checkpoint,
+                retries,
+                verifier,
+                compression,
+            )
+        finally:
+            if verifier:
+                verifier.close()
+
+    def _program_blocks(
+        self,
+        image,
+        blocks,
+        progress,
+        differential,
+        checkpoint,
+        retries,
+        verifier,
+        compression=None,
+    ):
+        skipped = 0
+        for block_index, (start_addr, length) in enumerate(blocks):
+            if verifier:
+                failed = self._readback_result(verifier, checkpoint)
+                if failed:
+                    return False, failed
+
+            crc = image.block_crc(start_addr, length)
+            journaled = checkpoint and checkpoint.is_verified(start_addr, length, crc)
+            if journaled:
+                # the journal only says the block was good; the ECU has the
+                # last word on whether it still is
+                if self.unchanged(start_addr, length, crc):
+                    print(f"[INFO] Block {block_index + 1} verified earlier, skipped")
+                    skipped += 1
+                    if progress:
+                        progress(block_index, 1, 1)
+                    continue
+                print(
+                    f"[WARN] Block {block_index + 1} verified earlier but its CRC "
+                    f"no longer matches, reflashing"
+                )
+                checkpoint.forget(start_addr, length, crc)
+
+            if (
+                differential
+                and not journaled
+                and self.unchanged(start_addr, length, crc)
+            ):
+                skipped += 1
+                if progress:
+                    progress(block_index, 1, 1)
+            else:
+                for attempt in range(retries + 1):
+                    success, message = self._program_block(
+                        image,
+                        block_index,
+                        start_addr,
+                        length,
+                        crc,
+                        progress,
+                        compression,
+                    )
+                    if success:
+                        break
+                    if attempt < retries:
+                        print(f"[WARN] {message}, retry {attempt + 1}/{retries}")
+                if not success:
+                    return False, message
+                if verifier:
+                    if not verifier.submit(block_index, start_addr, length, crc):
+                        return False, f"Readback failed at block {block_index + 1}"
+                    continue  # journaled once the compare passes
+
+            if checkpoint:
+                checkpoint.mark_verified(start_addr, length, crc)
+
+        if verifier:
+            failed = self._readback_result(verifier, checkpoint, wait=True)
+            if failed:
+                return False, failed
+        if differential or checkpoint:
+            print(f"[INFO] {skipped} of {len(blocks)} blocks skipped")
+        if checkpoint:
+            checkpoint.clear()
+        return True, "True"
+
+    @staticmethod
+    def _readback_result(verifier, checkpoint, wait=False):
+        """Journal blocks whose readback matched; message for the first that did not."""
+        from Flashing.readback import describe
+
+        for block_index, start_addr, length, crc, mismatches in verifier.finished(wait):
+            if mismatches:
+                print(
+                    f"[FAIL] Readback mismatch in block {block_index + 1}: "
+                    f"{describe(mismatches)}"
+                )
+                return f"Readback verification failed at block {block_index + 1}"
+            print(f"[OK] Block {block_index + 1} read back and matches")
+            if checkpoint:
+                checkpoint.mark_verified(start_addr, length, crc)
+        return None
+
+    def _program_block(
+        self, image, block_index, start_addr, length, crc, progress, compression=None
+    ):
+        """Erase, download and validate one block. Returns (success, message)."""
+        from Flashing.compression import compress_block, data_format
+
+        payload = None
+        if compression and data_format(compression) not in self.rejected_formats:
+            payload = compress_block(image, start_addr, length, compression)
+        if payload is None:
+            setup = self.setup(start_addr, length)
+        else:
+            fmt = data_format(compression)
+            setup = self.setup(start_addr, length, fmt, len(payload))
+            if fmt in self.rejected_formats:
+                payload = None  # refused just now: the block goes out as is
+        if not setup:
+            return False, f"Flash setup failed at block {block_index + 1}"
+        chunk_size, num_chunks = setup
+
+        chunk_counter = 0
+        success = False
+        for step in self.chunks(image, start_addr, length, chunk_size, payload):
+            if step is True:
+                chunk_counter += 1
+                if progress:
+                    progress(block_index, chunk_counter, num_chunks)
+            elif isinstance(step, tuple) and step[0] == "DONE":
+                success = step[1]
+        if not success:
+            return False, f"Flashing failed at block {block_index + 1}"
+
+        if not self.done(start_addr, length, crc, image=image):
+            return False, f"Flash validation failed at block {block_index + 1}"
+        return True, "True"
+
+
+# Session shared by the flashing steps of the current cycle
+_session = None
+# FlashSession arguments for the shared session (see configure_session)
+_session_defaults = {}
+
+
+def configure_session(**kwargs):
+    """
+    Set the FlashSession arguments used when the shared session is created,
+    e.g. configure_session(interface="virtual", channel="vcan0") to run the
+    GUI steps against Flashing.virtual_ecu, or
+    configure_session(**bus_settings("flash")) for station.ini's CAN FD
+    settings (UDS.bus_config).
+    """
+    _session_defaults.clear()
+    _session_defaults.update(kwargs)
+
+
+def get_session(**kwargs) -> FlashSession:
+    """Return the shared session, creating and opening it on first use."""
+    global _session
+    if _session is None:
+        _session = FlashSession(**{**_session_defaults, **kwargs})
+    return _session.open()
+
+
+def close_session():
+    """Shut the shared session's bus down (end of cycle or after errors)."""
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import mmap
+import os
+from typing import Optional
+
+from Flashing.compression import CompressionError, block_bytes, method
+from Flashing.firmware_formats import load_firmware
+from Flashing.segment_image import SegmentImage
+
+# Bump when the payload/index layout or the parsing rules change; stale
+# entries are rebuilt (2: S-record checksums validated)
+CACHE_VERSION = 2
+CACHE_DIRNAME = "image_cache"
+
+
+def firmware_digest(path: str) -> str:
+    """SHA-256 of the firmware file contents (the cache key)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_dir_for(mot_file: str) -> str:
+    """Default cache folder: image_cache next to the firmware file."""
+    return os.path.join(os.path.dirname(os.path.abspath(mot_file)), CACHE_DIRNAME)
+
+
+def _entry_paths(cache_dir: str, digest: str):
+    base = os.path.join(cache_dir, digest)
+    return base + ".bin", base + ".json"
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build_entry(mot_file: str, base_address: Optional[int] = None) -> SegmentImage:
+    """Parse the firmware file and precompute each block's CRC."""
+    image = load_firmware(mot_file, base_address)
+    image.precompute_crcs()
+    return image
+
+
+def store_entry(image: SegmentImage, source: str, cache_dir: str, digest: str):
+    """Store the decoded payload plus a segment/CRC index for the image."""
+    segments = []
+    offset = 0
+    for start, run in image.segments:
+        segments.append([start, offset, len(run)])
+        offset += len(run)
+    index = {
+        "version": CACHE_VERSION,
+        "source": os.path.basename(source),
+        "size": offset,
+        "segments": segments,
+        "blocks": [[s, n, crc] for (s, n), crc in sorted(image.crcs.items())],
+    }
+    os.makedirs(cache_dir, exist_ok=True)
+    bin_path, idx_path = _entry_paths(cache_dir, digest)
+    _write_atomic(bin_path, b"".join(run for _, run in image.segments))
+    # index written last: its presence marks the entry complete
+    _write_atomic(idx_path, json.dumps(index, indent=1).encode("ascii"))
+    print(f"[INFO] Image cache entry created: {digest[:12]}")
+
+
+def open_entry(cache_dir: str, digest: str) -> Optional[SegmentImage]:
+    """Map a cached payload; None if the entry is missing or unusable."""
+    bin_path, idx_path = _entry_paths(cache_dir, digest)
+    if not os.path.exists(idx_path):
+        return None
+    try:
+        with open(idx_path, "r", encoding="ascii") as f:
+            index = json.load(f)
+        if index.get("version") != CACHE_VERSION:
+            return None
+        if os.path.getsize(bin_path) != index["size"]:
+            return None
+
+        if index["size"]:
+            with open(bin_path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mm)
+        else:
+            mm, view = None, memoryview(b"")
+
+        image = SegmentImage.from_segments(
+            (start, view[offset : offset + length])
+            for start, offset, length in index["segments"]
+        )
+        image.crcs = {(s, n): crc for s, n, crc in index["blocks"]}
+        image._mmap = mm  # keep the mapping alive with the image
+        return image
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"[WARN] Image cache entry {digest[:12]} unusable: {e}")
+        return None
+
+
+def load_cached(
+    mot_file: str, cache_dir: Optional[str] = None, base_address: Optional[int] = None
+) -> SegmentImage:
+    """
+    Return the SegmentImage for mot_file, served from the content-addressed
+    cache when this exact file has been prepared before on the station.
+    base_address is the load address of raw .bin firmware.
+    """
+    if cache_dir is None:
+        cache_dir = cache_dir_for(mot_file)
+    digest = firmware_digest(mot_file)
+    if base_address is not None:
+        # the same binary at another address is another image
+        digest = f"{digest}-{base_address:08X}"
+    image = open_entry(cache_dir, digest)
+    if image is None:
+        image = build_entry(mot_file, base_address)
+        try:
+            store_entry(image, mot_file, cache_dir, digest)
+        except OSError as e:
+            # read-only station folder etc. — flash from the parsed image anyway
+            print(f"[WARN] Image cache unavailable: {e}")
+    image.digest = digest
+    return image
+
+
+def precompress(image: SegmentImage, name: str, cache_dir: str) -> bool:
+    """
+    Compress every block of the (planned) image with method name, ready for
+    a compressed download. Payloads are stored under cache_dir/<name>/ by the
+    SHA-256 of the block bytes, so they are reused whatever file, block plan
+    or fill byte produced the block. Blocks that do not shrink are recorded
+    as such and go out uncompressed. False when the method is unknown.
+    """
+    try:
+        compress = method(name)[1]
+    except CompressionError as e:
+        print(f"[WARN] {e}, blocks will be downloaded uncompressed")
+        return False
+    name = name.strip().lower()
+    folder = os.path.join(cache_dir, name)
+    raw = packed = 0
+    for start, length in image.blocks():
+        data = block_bytes(image, start, length)
+        path = os.path.join(folder, hashlib.sha256(data).hexdigest() + ".z")
+        payload = None
+        try:
+            with open(path, "rb") as f:
+                payload = f.read()
+        except OSError:
+            pass
+        if payload is None:
+            payload = compress(data)
+            try:
+                os.makedirs(folder, exist_ok=True)
+                _write_atomic(path, payload)
+            except OSError as e:
+                print(f"[WARN] Image cache unavailable: {e}")
+        shrinks = len(payload) < length
+        image.compressed[(name, start, length)] = payload if shrinks else None
+        raw += length
+        packed += len(payload) if shrinks else length
+    if raw:
+        print(f"[INFO] {name}: {raw} -> {packed} byte(s) ({packed / raw:.0%})")
+    return True
@@ -0,0 +1,80 @@
+from Flashing.flash_session import get_session
+
+# ISO 14229 0x87 fixed linkControlModeIdentifier per CAN bit rate; other
+# rates are verified with their specific baudrate (sub-function 0x02)
+FIXED_BAUDRATES = {125000: 0x10, 250000: 0x11, 500000: 0x12, 1000000: 0x13}
+
+LC_VERIFY_FIXED = 0x01
+LC_VERIFY_SPECIFIC = 0x02
+LC_TRANSITION = 0x03
+
+
+class LinkControlError(Exception):
+    pass
+
+
+def require(ok, msg: str):
+    """Raise on falsy result; return the value otherwise."""
+    if not ok:
+        raise LinkControlError(msg)
+    return ok
+
+
+def _verify(uds, bitrate: int):
+    mode_id = FIXED_BAUDRATES.get(bitrate)
+    if mode_id is not None:
+        return uds.link_control(LC_VERIFY_FIXED, mode_id=mode_id)
+    return uds.link_control(LC_VERIFY_SPECIFIC, baudrate=bitrate)
+
+
+def switch_link(bitrate: int, session=None) -> bool:
+    """
+    Move ECU and adapter to bitrate: 0x87 verify (is the rate supported in
+    this session?), 0x87 transition, reopen the adapter at the new rate and
+    confirm with Tester Present. On any failure the adapter goes back to the
+    rate it had and False is returned, so flashing carries on unswitched.
+    """
+    session = session or get_session()
+    original = session.bitrate
+    if bitrate == original:
+        return True
+    try:
+        session.keep_alive()
+        require(
+            _verify(session.uds, bitrate),
+            f"ECU does not support {bitrate} bit/s (0x87 verify rejected)",
+        )
+        require(
+            session.uds.link_control(LC_TRANSITION),
+            "Link transition (0x87 03) rejected",
+        )
+        session.reopen(bitrate)
+        require(
+            session.uds.tester_present(),
+            f"No response at {bitrate} bit/s",
+        )
+        print(f"[OK] Link switched {original} -> {bitrate} bit/s")
+        return True
+    except LinkControlError as e:
+        print(f"[WARN] Link speed unchanged: {e}")
+    except Exception as e:
+        print(f"[ERROR] Unexpected: {e}")
+    if session.bitrate != original:
+        session.reopen(original)
+    return False
+
+
+def restore_link(bitrate: int, session=None) -> bool:
+    """
+    Bring ECU and adapter back to bitrate after a switch_link(). The adapter
+    is reopened at bitrate even when the ECU refuses, since the ECU falls back
+    to its default rate on its own when the programming session ends.
+    """
+    session = session or get_session()
+    if session.bitrate == bitrate:
+        return True
+    if switch_link(bitrate, session=session):
+        return True
+    print(f"[WARN] ECU link not restored; adapter back at {bitrate} bit/s")
+    session.reopen(bitrate)
+    return False
@@ -0,0 +1,280 @@
+import multiprocessing
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from UDS.trace import TraceWriter
+from Flashing.flash_session import FlashSession
+from Flashing.block_planner import plan_blocks
+from Flashing.checkpoint import open_checkpoint
+from Flashing.image_cache import cache_dir_for, load_cached, precompress
+
+# Minimum time between two progress events of one job (the last chunk of a
+# block is always reported)
+PROGRESS_INTERVAL = 0.1
+
+
+class FlashOrchestratorError(Exception):
+    pass
+
+
+def throttle_progress(callback, interval: float = PROGRESS_INTERVAL):
+    """
+    program() progress callback forwarding at most one update per interval
+    seconds to callback(block_index, chunks_done, total_chunks); the last
+    chunk of a block always goes through.
+    """
+    last_emit = [0.0]
+
+    def on_progress(block_index, chunk_done, total_chunks):
+        now = time.monotonic()
+        if chunk_done == total_chunks or now - last_emit[0] >= interval:
+            last_emit[0] = now
+            callback(block_index, chunk_done, total_chunks)
+
+    return on_progress
+
+
+class FlashJob:
+    """One vehicle to flash: VIN, firmware file and the adapter it sits on."""
+
+    def __init__(
+        self,
+        vin: str,
+        mot_file: str,
+        channel: str = "PCAN_USBBUS1",
+        interface: str = "pcan",
+        bitrate: int = 500000,
+        differential: bool = False,
+        retries: int = 1,
+        block_plan=None,
+        verify: bool = False,
+        base_address=None,
+        identification=None,
+        link_bitrate=None,
+        compression=None,
+        tx_id: int = 0x7E0,
+        rx_id: int = 0x7E8,
+        fd: bool = False,
+        bus_kwargs=None,
+        frame_len=None,
+    ):
+        self.vin = vin
+        self.mot_file = mot_file
+        self.channel = channel
+        self.interface = interface
+        self.bitrate = bitrate
+        # transport, as for FlashSession: diagnostic ids, CAN FD, its frame
+        # length and extra can.Bus arguments (FD data-phase timing etc.);
+        # FlashJob(vin, mot_file, **bus_settings("flash")) takes station.ini's
+        self.tx_id = tx_id
+        self.rx_id = rx_id
+        self.fd = fd
+        self.bus_kwargs = dict(bus_kwargs or {})
+        self.frame_len = frame_len
+        self.differential = differential
+        self.retries = retries
+        self.block_plan = dict(block_plan or {})  # plan_blocks() arguments
+        self.verify = verify  # read blocks back after programming
+        self.base_address = base_address  # load address of raw .bin files
+        # {DID: value} of the target software; the job passes without
+        # flashing when the ECU already reports it
+        self.identification = dict(identification or {})
+        # download at this rate (0x87 LinkControl) when the ECU agrees
+        self.link_bitrate = link_bitrate
+        # Flashing.compression method for compressed downloads
+        self.compression = compression
+
+    def __repr__(self):
+        return f"FlashJob({self.vin!r}, {self.mot_file!r}, channel={self.channel!r})"
+
+
+class FlashResult:
+    def __init__(self, vin, channel, success, message, duration):
+        self.vin = vin
+        self.channel = channel
+        self.success = success
+        self.message = message
+        self.duration = duration
+
+    def __repr__(self):
+        status = "PASSED" if self.success else "FAILED"
+        return (
+            f"FlashResult({self.vin!r} on {self.channel}: {status}, "
+            f"{self.message!r}, {self.duration:.1f}s)"
+        )
+
+
+def flash_job(job: FlashJob, events=None) -> FlashResult:
+    """
+    Preflash, program and postflash one vehicle on its own bus. Runs inside a
+    pool worker; progress goes to the events queue as
+    ("blocks", vin, channel, block_count) and
+    ("progress", vin, channel, block_index, chunks_done, total_chunks).
+    """
+    t0 = time.time()
+
+    def emit(*event):
+        if events is not None:
+            events.put(event)
+
+    on_progress = throttle_progress(
+        lambda block_index, chunk_done, total_chunks: emit(
+            "progress", job.vin, job.channel, block_index, chunk_done, total_chunks
+        )
+    )
+
+    def result(success, message):
+        return FlashResult(job.vin, job.channel, success, message, time.time() - t0)
+
+    # one trace file per channel; workers must not share a trace file
+    trace = TraceWriter(f"uds_trace_{job.channel}")
+    try:
+        image = plan_blocks(
+            load_cached(job.mot_file, base_address=job.base_address), **job.block_plan
+        )
+        if job.compression:
+            precompress(image, job.compression, cache_dir_for(job.mot_file))
+        emit("blocks", job.vin, job.channel, len(image.blocks()))
+
+        with FlashSession(
+            interface=job.interface,
+            channel=job.channel,
+            bitrate=job.bitrate,
+            tx_id=job.tx_id,
+            rx_id=job.rx_id,
+            trace=trace,
+            fd=job.fd,
+            bus_kwargs=job.bus_kwargs,
+            frame_len=job.frame_len,
+        ) as session:
+            if job.identification and session.software_current(job.identification):
+                return result(True, "Software already current")
+            if not session.preflash():
+                return result(False, "Preflashing failed")
+            with session.link_speed(job.link_bitrate):
+                success, message = session.program(
+                    image,
+                    progress=on_progress,
+                    differential=job.differential,
+                    checkpoint=open_checkpoint(job.vin, image),
+                    retries=job.retries,
+                    verify=job.verify,
+                    compression=job.compression,
+                )
+            if not success:
+                return result(False, message)
+            if not session.postflash():
+                return result(False, "Postflashing failed")
+        return result(True, "True")
+    except Exception as e:
+        print(f"[ERROR] Unexpected on {job.channel}: {e}")
+        return result(False, f"Flashing process failed: {e}")
+    finally:
+        trace.close()
+
+
+def _flash_channel(jobs, events):
+    """Pool task: the jobs of one channel, one after the other."""
+    return [flash_job(job, events) for job in jobs]
+
+
+class FlashOrchestrator:
+    """
+    Runs independent flash jobs in a process pool, one worker per CAN
+    channel, so a station with several adapters flashes several vehicles at
+    once. Jobs that share a channel are flashed in turn by the same worker.
+    """
+
+    def __init__(self, initializer=None, initargs=()):
+        # initializer runs once per worker process (e.g. to start a simulated
+        # ECU next to a virtual channel in tests)
+        self.initializer = initializer
+        self.initargs = initargs
+
+    @staticmethod
+    def group_by_channel(jobs):
+        groups = {}
+        for job in jobs:
+            groups.setdefault((job.interface, job.channel), []).append(job)
+        return groups
+
+    def run(self, jobs, on_progress=None, on_result=None, poll_interval=0.05):
+        """
+        Flash all jobs and return their FlashResults in the order given.
+        on_progress(event) receives the events described in flash_job;
+        on_result(FlashResult) is called as each job finishes. Both are
+        called from the calling thread.
+        """
+        jobs = list(jobs)
+        if not jobs:
+            raise FlashOrchestratorError("No flash jobs given")
+        vins = [job.vin for job in jobs]
+        if len(set(vins)) != len(vins):
+            raise FlashOrchestratorError("Duplicate VIN in flash jobs")
+
+        groups = self.group_by_channel(jobs)
+        results = {}
+        with multiprocessing.Manager() as manager:
+            events = manager.Queue()
+
+            def drain():
+                while True:
+                    try:
+                        event = events.get_nowait()
+                    except queue.Empty:
+                        return
+                    if on_progress:
+                        on_progress(event)
+
+            with ProcessPoolExecutor(
+                max_workers=len(groups),
+                initializer=self.initializer,
+                initargs=self.initargs,
+            ) as pool:
+                pending = {
+                    pool.submit(_flash_channel, group, events): group
+                    for group in groups.values()
+                }
+                while pending:
+                    done = [f for f in pending if f.done()]
+                    drain()
+                    for future in done:
+                        group = pending.pop(future)
+                        try:
+                            channel_results = future.result()
+                        except Exception as e:
+                            channel_results = [
+                                FlashResult(j.vin, j.channel, False, f"Worker failed: {e}", 0.0)
+                                for j in group
+                            ]
+                        for res in channel_results:
+                            results[res.vin] = res
+                            if on_result:
+                                on_result(res)
+                    if pending and not done:
+                        time.sleep(poll_interval)
+            drain()
+
+        return [results[vin] for vin in vins]
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print("usage: python -m Flashing.orchestrator <mot_file> VIN:CHANNEL ...")
+        sys.exit(2)
+    mot = sys.argv[1]
+    flash_jobs = []
+    for spec in sys.argv[2:]:
+        vin, _, channel = spec.partition(":")
+        flash_jobs.append(FlashJob(vin, mot, channel=channel or "PCAN_USBBUS1"))
+
+    def show(event):
+        if event[0] == "progress":
+            _, vin, channel, block, done, total = event
+            print(f"[INFO] {vin} ({channel}) block {block + 1}: {done}/{total}")
+
+    for res in FlashOrchestrator().run(flash_jobs, on_progress=show):
+        print(res)
@@ -0,0 +1,138 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from Flashing.flash_session import get_session
+from Flashing.segment_image import as_image
+
+# Bytes per 0x23 request: the largest classic ISO-TP response is 4095 bytes,
+# one of which is the 0x63 SID
+READ_CHUNK = 4094
+
+
+class ReadbackError(Exception):
+    pass
+
+
+def require(ok, msg: str):
+    """Raise on falsy result; return the value otherwise."""
+    if not ok:
+        raise ReadbackError(msg)
+    return ok
+
+
+def mismatch_ranges(expected, actual, base: int = 0) -> List[Tuple[int, int]]:
+    """
+    (address, length) of every run of differing bytes between two equally
+    long buffers, found with NumPy array compares instead of a byte loop.
+    """
+    a = np.frombuffer(expected, dtype=np.uint8)
+    b = np.frombuffer(actual, dtype=np.uint8)
+    if a.shape != b.shape:
+        raise ReadbackError(f"Readback length {b.size} != image length {a.size}")
+    diff = np.empty(a.size + 2, dtype=np.int8)
+    diff[0] = diff[-1] = 0
+    np.not_equal(a, b, out=diff[1:-1], casting="unsafe")
+    edges = np.flatnonzero(np.diff(diff))
+    starts, ends = edges[0::2], edges[1::2]
+    return [(base + int(s), int(e - s)) for s, e in zip(starts, ends)]
+
+
+def read_block(uds, address: int, length: int, chunk: int = READ_CHUNK) -> bytearray:
+    """Stream [address, address + length) back from the ECU with 0x23."""
+    data = bytearray()
+    while len(data) < length:
+        size = min(chunk, length - len(data))
+        part = require(
+            uds.read_memory_by_address(address + len(data), size),
+            f"ReadMemoryByAddress failed at 0x{address + len(data):08X}",
+        )
+        require(
+            len(part) == size,
+            f"ReadMemoryByAddress returned {len(part)} of {size} bytes",
+        )
+        data += part
+    return data
+
+
+def compare_block(image, address: int, length: int, data) -> List[Tuple[int, int]]:
+    expected = b"".join(image.iter_chunks(address, length, length))
+    return mismatch_ranges(expected, data, address)
+
+
+def describe(mismatches: List[Tuple[int, int]]) -> str:
+    first, first_len = mismatches[0]
+    total = sum(n for _, n in mismatches)
+    return (
+        f"{len(mismatches)} range(s), first at 0x{first:08X} (+{first_len}), "
+        f"{total} byte(s) differ"
+    )
+
+
+class ReadbackVerifier:
+    """
+    Reads each programmed block back and compares it with the image. The
+    bus read happens right after the block's validation (UDS allows one
+    request at a time); the compare runs on a worker thread, NumPy releasing
+    the GIL, while program() already erases and downloads the next block.
+    finished() collects the compares that are done.
+    """
+
+    def __init__(self, image, session, chunk: int = READ_CHUNK):
+        self.image = as_image(image)
+        self.session = session
+        self.chunk = chunk
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="readback")
+        self._pending = []  # (block_index, address, length, crc, future)
+
+    def submit(self, block_index: int, address: int, length: int, crc: int) -> bool:
+        """Read the block back now and queue its compare; False if the read failed."""
+        try:
+            self.session.keep_alive()
+            data = read_block(self.session.uds, address, length, self.chunk)
+        except ReadbackError as e:
+            print(f"[FAIL] {e}")
+            return False
+        future = self._pool.submit(compare_block, self.image, address, length, data)
+        self._pending.append((block_index, address, length, crc, future))
+        return True
+
+    def finished(self, wait: bool = False):
+        """
+        (block_index, address, length, crc, mismatches) for every compare
+        that is done, or for all of them when wait=True.
+        """
+        done, still = [], []
+        for entry in self._pending:
+            future = entry[-1]
+            if wait or future.done():
+                done.append(entry[:-1] + (future.result(),))
+            else:
+                still.append(entry)
+        self._pending = still
+        return done
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def verify_block(address, length, image=None, session=None) -> Optional[bool]:
+    """Stand-alone readback check of one block; True when it matches."""
+    try:
+        image = as_image(image)
+        session = session or get_session()
+        session.keep_alive()
+        data = read_block(session.uds, address, length)
+        mismatches = compare_block(image, address, length, data)
+        if mismatches:
+            print(f"[FAIL] Readback mismatch at 0x{address:08X}: {describe(mismatches)}")
+            return False
+        print(f"[OK] Readback of 0x{address:08X} ({length} bytes) matches")
+        return True
+    except (ReadbackError, ValueError) as e:
+        print(f"[FAIL] {e}")
+        return False
+    except Exception as e:
+        print(f"[ERROR] Unexpected: {e}")
+        return False
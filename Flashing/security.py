@@ -0,0 +1,132 @@
+import abc
+import ctypes
+import threading
+from ctypes import POINTER, c_int, c_ubyte
+from typing import Dict, Optional
+
+from Crypto.Cipher import AES
+
+# Bootloader seed/key secrets: the key is AES-128-ECB(secret, seed)
+AES_SECRETS = {
+    0x03: bytes.fromhex("E6AB4112C0FBD97834DAA6606FA45D65"),  # first access (03/04)
+    0x01: bytes.fromhex("DCDEE01FAB9D7AB77B49C9FFD075B364"),  # second access (01/02)
+}
+
+
+class SeedKeyAlgorithm(abc.ABC):
+    """
+    Seed -> key for 0x27 SecurityAccess. Implementations do their setup
+    once in __init__; key() is called per seed and returns None when no key
+    can be computed. The tester and Flashing.virtual_ecu share instances.
+    """
+
+    levels = ()  # request-seed sub-functions the algorithm serves
+
+    @abc.abstractmethod
+    def key(self, seed: bytes, level: int) -> Optional[bytes]:
+        pass
+
+
+class AesSeedKey(SeedKeyAlgorithm):
+    """AES-128-ECB of the 16-byte seed, one ready cipher per level."""
+
+    def __init__(self, secrets: Dict[int, bytes] = AES_SECRETS):
+        self.levels = tuple(secrets)
+        # ECB keeps no state between blocks, so a cipher object is reusable
+        self._ciphers = {
+            level: AES.new(secret, AES.MODE_ECB) for level, secret in secrets.items()
+        }
+
+    def key(self, seed: bytes, level: int) -> Optional[bytes]:
+        cipher = self._ciphers.get(level)
+        if cipher is None or not seed or len(seed) != 16:
+            return None
+        return cipher.encrypt(bytes(seed))
+
+
+class DllSeedKey(SeedKeyAlgorithm):
+    """
+    Supplier key generation DLL (SedKeyGen_Init / SedKeyGen_GetKey), loaded
+    and prototyped once. SedKeyGen_Init runs again only when the level
+    group changes.
+    """
+
+    def __init__(self, dll_path: str, key_length: int = 4):
+        # Load DLL (try cdecl first, fallback to stdcall)
+        try:
+            lib = ctypes.CDLL(dll_path)
+        except OSError:
+            lib = ctypes.WinDLL(dll_path)
+        self._init = lib.SedKeyGen_Init
+        self._init.argtypes = [c_int]
+        self._init.restype = c_int
+        # Signature: int SedKeyGen_GetKey(int level, const uint8_t* seed, uint8_t* key)
+        self._get_key = lib.SedKeyGen_GetKey
+        self._get_key.argtypes = [c_int, POINTER(c_ubyte), POINTER(c_ubyte)]
+        self._get_key.restype = c_int  # error code
+        self.key_length = key_length
+        self._key_buf = (c_ubyte * key_length)()
+        self._value = None  # level group SedKeyGen_Init was run for
+        self._lock = threading.Lock()
+
+    def key(self, seed: bytes, level: int) -> Optional[bytes]:
+        # Map security level to value (adjust this mapping if needed)
+        value = (level - 1) // 2
+        with self._lock:
+            if value != self._value:
+                result = self._init(value)
+                if result != 0:
+                    print(f"[ERROR] Initialization failed with code {result}")
+                    return None
+                self._value = value
+            seed_array = (c_ubyte * len(seed)).from_buffer_copy(bytes(seed))
+            result = self._get_key(value, seed_array, self._key_buf)
+            if result != 0:
+                print(f"[ERROR] Key generation failed with error code: {result}")
+                return None
+            return bytes(self._key_buf)
+
+
+# Per-process instances: ciphers built and DLLs loaded on first use only
+_aes = None
+_dlls: Dict[tuple, DllSeedKey] = {}
+_lock = threading.Lock()
+
+
+def aes_seed_key() -> AesSeedKey:
+    global _aes
+    with _lock:
+        if _aes is None:
+            _aes = AesSeedKey()
+        return _aes
+
+
+def dll_seed_key(dll_path: str, key_length: int = 4) -> DllSeedKey:
+    with _lock:
+        algorithm = _dlls.get((dll_path, key_length))
+        if algorithm is None:
+            algorithm = _dlls[(dll_path, key_length)] = DllSeedKey(dll_path, key_length)
+        return algorithm
+
+
+def encrypt_seed(seed, level):
+    """AES key for level 3 (first access) or any other level (second access)."""
+    encrypted_full = aes_seed_key().key(seed, 0x03 if level == 3 else 0x01)
+    if encrypted_full is None:
+        return None
+    print(f"Encrypted Key: {encrypted_full.hex()}")
+    print("AES Encryption Passed\n")
+    return encrypted_full
+
+
+def calculate_key_from_seed(
+    seed_bytes: bytes,
+    dll_path: str,
+    key_length: int = 4,
+    security_level: int = 1,
+) -> bytes | None:
+    try:
+        return dll_seed_key(dll_path, key_length).key(seed_bytes, security_level)
+    except Exception as e:
+        print(f"[ERROR] Exception calling DLL function: {e}")
+        return None
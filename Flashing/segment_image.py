@@ -0,0 +1,279 @@
+import binascii
+import bisect
+import os
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from Flashing import crc16
+
+
+class SegmentImageError(Exception):
+    pass
+
+
+class SegmentImage:
+    """
+    Sparse firmware image held as sorted, non-overlapping ``(start, bytearray)``
+    runs. Records are merged into the runs as they are written, so block
+    discovery, chunk iteration and CRC all work from memory after one pass.
+    """
+
+    def __init__(self):
+        self._starts: List[int] = []
+        self._runs: List[bytearray] = []
+        self._last = -1  # run extended by the previous write (fast path)
+        self.crcs: Dict[Tuple[int, int], int] = {}  # (start, length) -> CRC
+        # (method, start, length) -> compressed block, see Flashing.compression
+        self.compressed: Dict[Tuple[str, int, int], Optional[bytes]] = {}
+        self.digest = None  # SHA-256 of the source file, set by image_cache
+
+    @classmethod
+    def from_segments(cls, segments) -> "SegmentImage":
+        """
+        Wrap already merged, sorted (start, buffer) runs without copying, e.g.
+        memoryview slices of a memory-mapped cache payload. Such an image is
+        read-only.
+        """
+        image = cls()
+        for start, run in segments:
+            image._starts.append(start)
+            image._runs.append(run)
+        return image
+
+    # ── building ─────────────────────────────────────────────────
+    def write(self, addr: int, data: bytes):
+        if not data:
+            return
+        end = addr + len(data)
+        starts, runs = self._starts, self._runs
+
+        # Fast path: record continues the run we extended last time
+        i = self._last
+        if i >= 0:
+            run = runs[i]
+            nxt = starts[i + 1] if i + 1 < len(starts) else None
+            if addr == starts[i] + len(run) and (nxt is None or end <= nxt):
+                run += data
+                if nxt is not None and end == nxt:
+                    run += runs[i + 1]
+                    del starts[i + 1], runs[i + 1]
+                return
+
+        # General path: merge with every run the record touches or overlaps
+        lo = bisect.bisect_right(starts, addr) - 1
+        if lo < 0 or addr > starts[lo] + len(runs[lo]):
+            lo += 1
+        hi = bisect.bisect_right(starts, end)
+
+        if lo == hi:
+            starts.insert(lo, addr)
+            runs.insert(lo, bytearray(data))
+        else:
+            new_start = min(addr, starts[lo])
+            new_end = max(end, starts[hi - 1] + len(runs[hi - 1]))
+            merged = bytearray(new_end - new_start)
+            for s, r in zip(starts[lo:hi], runs[lo:hi]):
+                merged[s - new_start : s - new_start + len(r)] = r
+            # later records win, same as the old per-byte dict
+            merged[addr - new_start : end - new_start] = data
+            starts[lo:hi] = [new_start]
+            runs[lo:hi] = [merged]
+        self._last = lo
+
+    # ── queries ──────────────────────────────────────────────────
+    @property
+    def segments(self) -> List[Tuple[int, bytearray]]:
+        return list(zip(self._starts, self._runs))
+
+    def __len__(self) -> int:
+        return sum(len(r) for r in self._runs)
+
+    def blocks(self) -> List[Tuple[int, int]]:
+        """Contiguous (start_address, length) blocks, ascending."""
+        return [(s, len(r)) for s, r in zip(self._starts, self._runs)]
+
+    def block_crc(self, start_addr: int, length: int) -> int:
+        """Block CRC from the precomputed index, computed on first request."""
+        key = (start_addr, length)
+        crc = self.crcs.get(key)
+        if crc is None:
+            crc = self.crcs[key] = crc16.block_crc(self, start_addr, length)
+        return crc
+
+    def precompute_crcs(self):
+        """Fill the CRC index for every block so flashing does no CRC work."""
+        for start, length in self.blocks():
+            self.block_crc(start, length)
+
+    def iter_chunks(
+        self, start_addr: int, length: int, chunk_size: int
+    ) -> Iterator[Union[memoryview, bytes]]:
+        """
+        Yield the image bytes in [start_addr, start_addr + length) in pieces of
+        chunk_size. Inside a single run the pieces are zero-copy memoryviews;
+        bytes missing from the image are skipped, as the old parser did.
+        """
+        if chunk_size <= 0:
+            raise SegmentImageError(f"Invalid chunk size {chunk_size}")
+        end = start_addr + length
+        buf = bytearray()
+        i = max(0, bisect.bisect_right(self._starts, start_addr) - 1)
+        while i < len(self._starts) and self._starts[i] < end:
+            s, run = self._starts[i], self._runs[i]
+            a = max(start_addr, s) - s
+            b = min(end, s + len(run)) - s
+            i += 1
+            if a >= b:
+                continue
+            view = memoryview(run)[a:b]
+            if buf:
+                take = min(chunk_size - len(buf), len(view))
+                buf += view[:take]
+                view = view[take:]
+                if len(buf) < chunk_size:
+                    continue
+                yield bytes(buf)
+                buf.clear()
+            full = len(view) - len(view) % chunk_size
+            for off in range(0, full, chunk_size):
+                yield view[off : off + chunk_size]
+            buf += view[full:]
+        if buf:
+            yield bytes(buf)
+
+
+# Address bytes per S-record type; data records are S1-S3 (S4 is reserved)
+_ADDR_LEN = np.array([2, 2, 3, 4, 0, 2, 3, 4, 3, 2], dtype=np.int64)
+
+_HEX_DIGIT = np.zeros(256, dtype=bool)
+_HEX_DIGIT[list(b"0123456789ABCDEFabcdef")] = True
+_SPACE = np.zeros(256, dtype=bool)
+_SPACE[list(b" \t\r\v\f")] = True
+
+
+def load_srec(mot_file_path: str) -> SegmentImage:
+    """
+    Parse and validate a Motorola S-record file into a SegmentImage.
+    The file is read into one buffer; line splitting, hex decoding and the
+    byte count and checksum of every record are NumPy array operations, so
+    a corrupted file is rejected before any block is erased. Data records
+    are then written run by run instead of line by line.
+    """
+    with open(mot_file_path, "rb") as f:
+        raw = f.read()
+    # S-records are ASCII by spec
+    if not raw.isascii():
+        raise SegmentImageError("File is not ASCII")
+    image = SegmentImage()
+    if not raw:
+        return image
+    buf = np.frombuffer(raw, dtype=np.uint8)
+
+    # line bounds without the line break, then stripped like str.strip()
+    ends = np.flatnonzero(buf == 0x0A)
+    if not raw.endswith(b"\n"):
+        ends = np.append(ends, len(raw))
+    begins = np.concatenate(([0], ends[:-1] + 1))
+    lineno = np.arange(1, ends.size + 1)
+    while True:
+        more = (begins < ends) & _SPACE[buf[np.minimum(begins, len(raw) - 1)]]
+        if not more.any():
+            break
+        begins = begins + more
+    while True:
+        less = (ends > begins) & _SPACE[buf[ends - 1]]
+        if not less.any():
+            break
+        ends = ends - less
+
+    # records: "S" + type digit (S4 is reserved) + hex
+    keep = ends - begins >= 2
+    begins, ends, lineno = begins[keep], ends[keep], lineno[keep]
+    rectypes = buf[begins + 1].astype(np.int64) - 0x30
+    keep = (buf[begins] == 0x53) & (rectypes >= 0) & (rectypes <= 9) & (rectypes != 4)
+    begins, ends, lineno, rectypes = begins[keep], ends[keep], lineno[keep], rectypes[keep]
+    if not begins.size:
+        return image
+
+    def first_bad(mask, what):
+        bad = np.flatnonzero(mask)
+        if bad.size:
+            i = int(bad[0])
+            raise SegmentImageError(f"Line {lineno[i]}: S{rectypes[i]} {what}")
+
+    nibbles = ends - begins - 2
+    first_bad(nibbles & 1, "odd number of hex digits")
+
+    # the hex text of every record, cut out with one mask and decoded in
+    # one call (the mask toggles at each record's first and past-last digit)
+    filled = nibbles > 0
+    toggle = np.zeros(buf.size + 1, dtype=bool)
+    toggle[begins[filled] + 2] = True
+    toggle[ends[filled]] = True
+    digits = buf[np.logical_xor.accumulate(toggle[:-1])]
+    try:
+        data = np.frombuffer(binascii.unhexlify(digits.tobytes()), dtype=np.uint8)
+    except binascii.Error:
+        invalid = np.flatnonzero(~_HEX_DIGIT[digits])[0]
+        record = np.searchsorted(np.cumsum(nibbles), invalid, side="right")
+        first_bad(np.arange(nibbles.size) == record, "invalid hex digit")
+
+    # record layout: [count][addr...][data...][checksum]
+    lengths = nibbles >> 1
+    offsets = np.cumsum(lengths) - lengths
+    alen = _ADDR_LEN[rectypes]
+    first_bad(lengths < alen + 2, "too short")
+    first_bad(data[offsets] != lengths - 1, "byte count mismatch")
+    sums = np.add.reduceat(data, offsets, dtype=np.uint32)
+    first_bad((sums & 0xFF) != 0xFF, "checksum error")
+
+    # data records: payload bytes gathered in file order with one mask
+    rec = np.flatnonzero((rectypes >= 1) & (rectypes <= 3))
+    if not rec.size:
+        return image
+    offsets, alen = offsets[rec], alen[rec]
+    starts = offsets + 1 + alen
+    sizes = lengths[rec] - 2 - alen
+    addrs = np.zeros(rec.size, dtype=np.int64)
+    for k in range(4):
+        sel = alen > k
+        addrs[sel] = (addrs[sel] << 8) | data[offsets[sel] + 1 + k]
+    filled = sizes > 0
+    toggle = np.zeros(data.size + 1, dtype=bool)
+    toggle[starts[filled]] = True
+    toggle[(starts + sizes)[filled]] = True
+    payload = data[np.logical_xor.accumulate(toggle[:-1])].tobytes()
+
+    # consecutive records continuing at the previous end form one write
+    placed = np.cumsum(sizes) - sizes
+    breaks = np.flatnonzero(addrs[1:] != addrs[:-1] + sizes[:-1]) + 1
+    bounds = [0, *breaks.tolist(), rec.size]
+    view = memoryview(payload)
+    for a, b in zip(bounds, bounds[1:]):
+        lo = int(placed[a])
+        hi = int(placed[b - 1] + sizes[b - 1])
+        image.write(int(addrs[a]), view[lo:hi])
+    return image
+
+
+# Images for this process, keyed by path + stat so that find_addr_len and
+# flash_chunk share one load of the same file.
+_loaded = {}
+
+
+def as_image(source) -> SegmentImage:
+    """Accept a SegmentImage or a firmware path; load each file at most once."""
+    if isinstance(source, SegmentImage):
+        return source
+    # local import: image_cache builds on this module
+    from Flashing.image_cache import load_cached
+
+    path = os.path.abspath(source)
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    image = _loaded.get(key)
+    if image is None:
+        _loaded.clear()
+        image = _loaded[key] = load_cached(path)
+    return image
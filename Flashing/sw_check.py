@@ -0,0 +1,103 @@
+from typing import Dict
+
+from Flashing.flash_session import get_session
+
+# ISO 14229 identification DIDs compared before flashing
+DID_SPARE_PART_NUMBER = 0xF187
+DID_ECU_SOFTWARE_NUMBER = 0xF188
+
+# Record length (bytes after the DID) of each identification DID, as the
+# ECU's data definition fixes it. A multi-DID 0x22 response does not say
+# where one record ends, so the DIDs are read in one request only when
+# every length is listed here, e.g. {DID_SPARE_PART_NUMBER: 10}
+DID_RECORD_LENGTHS: Dict[int, int] = {}
+
+# Padding ECUs put after short identification strings
+_PAD = b"\x00 \xff"
+
+
+class SwCheckError(Exception):
+    pass
+
+
+def require(ok, msg: str):
+    """Raise on falsy result; return the value otherwise."""
+    if not ok:
+        raise SwCheckError(msg)
+    return ok
+
+
+def split_did_records(data: bytes, dids, lengths: Dict[int, int]) -> Dict[int, bytes]:
+    """
+    Split a multi-DID 0x62 payload (DID + data, ...) for DIDs requested in
+    this order. Record lengths are not sent, so each one is taken from
+    lengths (bytes after the DID).
+    """
+    records = {}
+    pos = 0
+    for did in dids:
+        require(
+            data[pos : pos + 2] == did.to_bytes(2, "big"),
+            f"DID 0x{did:04X} missing in response",
+        )
+        pos += 2
+        end = pos + lengths[did]
+        require(end <= len(data), f"DID 0x{did:04X} record truncated")
+        records[did] = data[pos:end]
+        pos = end
+    require(pos == len(data), "Unexpected data after the last DID record")
+    return records
+
+
+def read_did_records(uds, dids, lengths=None) -> Dict[int, bytes]:
+    """
+    Records of dids: one 0x22 request when every record length is known
+    (lengths, DID_RECORD_LENGTHS by default), otherwise one request per DID.
+    """
+    lengths = DID_RECORD_LENGTHS if lengths is None else lengths
+    dids = list(dids)
+    if len(dids) > 1 and all(did in lengths for did in dids):
+        data = require(
+            uds.read_data_by_identifier(*dids), "Read identification DIDs failed"
+        )
+        return split_did_records(data, dids, lengths)
+    records = {}
+    for did in dids:
+        data = require(
+            uds.read_data_by_identifier(did), f"Read DID 0x{did:04X} failed"
+        )
+        require(
+            data[:2] == did.to_bytes(2, "big"), f"DID 0x{did:04X} missing in response"
+        )
+        records[did] = data[2:]
+    return records
+
+
+def software_is_current(
+    expected: Dict[int, bytes], session=None, lengths=None
+) -> bool:
+    """
+    Read every DID in expected (see read_did_records) and compare it with
+    the target value (trailing padding ignored). True when all match, i.e. the
+    ECU already runs the target software and flashing can be skipped.
+    """
+    try:
+        require(expected, "No target identification")
+        session = session or get_session()
+        session.keep_alive()
+        found = read_did_records(session.uds, expected, lengths)
+        current = True
+        for did, target in expected.items():
+            ecu = found[did].rstrip(_PAD)
+            if ecu != bytes(target).rstrip(_PAD):
+                print(f"[INFO] DID 0x{did:04X}: ECU {ecu!r}, target {bytes(target)!r}")
+                current = False
+        if current:
+            print("[OK] ECU software already current")
+        return current
+    except SwCheckError as e:
+        print(f"[WARN] Software check skipped: {e}")
+        return False
+    except Exception as e:
+        print(f"[ERROR] Unexpected: {e}")
+        return False
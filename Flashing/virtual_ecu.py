@@ -0,0 +1,505 @@
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import can
+
+from UDS.isotp import IsoTpHandler, fd_frame_length
+from Flashing.compression import data_format, method
+from Flashing.crc16 import crc16_ccitt_8408
+from Flashing.security import SeedKeyAlgorithm, aes_seed_key
+
+# Negative response codes used by the simulator
+NRC_SERVICE_NOT_SUPPORTED = 0x11
+NRC_SUBFUNCTION_NOT_SUPPORTED = 0x12
+NRC_INCORRECT_LENGTH = 0x13
+NRC_REQUEST_SEQUENCE_ERROR = 0x24
+NRC_REQUEST_OUT_OF_RANGE = 0x31
+NRC_SECURITY_ACCESS_DENIED = 0x33
+NRC_INVALID_KEY = 0x35
+NRC_UPLOAD_DOWNLOAD_NOT_ACCEPTED = 0x70
+NRC_TRANSFER_DATA_SUSPENDED = 0x71
+NRC_GENERAL_PROGRAMMING_FAILURE = 0x72
+NRC_WRONG_BLOCK_SEQUENCE_COUNTER = 0x73
+
+# 0x87 fixed linkControlModeIdentifier -> CAN bit rate
+LINK_MODES = {0x10: 125000, 0x11: 250000, 0x12: 500000, 0x13: 1000000}
+
+
+class VirtualEcuError(Exception):
+    pass
+
+
+class _Nrc(Exception):
+    def __init__(self, nrc: int):
+        self.nrc = nrc
+
+
+class VirtualEcu(threading.Thread):
+    """
+    Simulated flashing bootloader on python-can's virtual interface.
+
+    Implements the services the station uses (0x10, 0x11, 0x14, 0x19, 0x22,
+    0x23, 0x27 with the tester's seed/key algorithm from Flashing.security,
+    0x31 FF00/FF01, 0x34/0x36/0x37, 0x3E, 0x85, 0x87) over ISO-TP, classic or
+    CAN FD (fd=True), with configurable BS/STmin,
+    maxNumberOfBlockLength and response latency. Slow services can answer
+    NRC 0x78 first (pending) and requests can be held with FC Wait frames
+    (fc_waits). Faults are injected per service with inject().
+
+    Downloaded blocks are kept in ``memory`` ({start_address: bytearray}) and
+    FF01 checks the CRC against them, so a second differential run finds
+    every block unchanged. Compressed downloads (0x34 dataFormatIdentifier of
+    a Flashing.compression method in ``compression``) are decompressed on
+    0x37; other formats get NRC 0x31.
+    """
+
+    def __init__(
+        self,
+        channel: str = "vcan0",
+        rx_id: int = 0x7E0,
+        tx_id: int = 0x7E8,
+        max_block_length: int = 0x82,
+        bs: int = 0,
+        stmin: int = 0,
+        latency: float = 0.0,
+        service_latency: Optional[Dict[int, float]] = None,
+        dids: Optional[Dict[int, bytes]] = None,
+        padding: int = 0x00,
+        fd: bool = False,
+        pending: Optional[Dict[int, int]] = None,
+        fc_waits: int = 0,
+        wait_interval: float = 0.01,
+        security: Optional[SeedKeyAlgorithm] = None,
+        link_rates=(500000, 1000000),
+        compression=("zlib", "lzma"),
+    ):
+        super().__init__(name=f"virtual-ecu-{channel}", daemon=True)
+        self.channel = channel
+        self.rx_id = rx_id
+        self.tx_id = tx_id
+        self.max_block_length = max_block_length
+        self.bs = bs  # block size sent in our Flow Control
+        self.stmin = stmin  # raw STmin byte sent in our Flow Control
+        self.latency = latency  # seconds before every response
+        self.service_latency = dict(service_latency or {})  # per SID
+        self.dids = dict(dids or {})
+        self.padding = padding
+        self.fd = fd
+        self.pending = dict(pending or {})  # SID -> 0x78 answers before the final
+        self.fc_waits = fc_waits  # FC Wait frames before each CTS
+        self.wait_interval = wait_interval  # seconds between 0x78 / FC Wait
+        # seed/key algorithm, the tester's own by default
+        self.security = security or aes_seed_key()
+        # bit rates 0x87 LinkControl accepts; the first is the default. The
+        # virtual bus has no bit rate, so the switch is only recorded
+        self.link_rates = tuple(link_rates)
+        # 0x34 dataFormatIdentifier -> decompress, for the accepted methods
+        self.formats = {data_format(name): method(name)[2] for name in compression}
+        self.frame_len = 64 if fd else 8
+
+        self.memory: Dict[int, bytearray] = {}
+        self.requests = []  # (timestamp, request bytes) of every request
+        self.stmin_violations = 0
+
+        self._faults = {}  # SID -> [nrc or None (no response), remaining]
+        self._halt = threading.Event()
+        self._bus = None
+        self._reset_state()
+
+    # ── configuration ────────────────────────────────────────────
+    def inject(self, sid: int, nrc: Optional[int] = None, count: int = 1):
+        """
+        Fail the next `count` requests of service `sid`: answer with NRC
+        `nrc`, or send no response at all when nrc is None (P2 timeout).
+        """
+        self._faults[sid] = [nrc, count]
+
+    def _reset_state(self):
+        self.session = 0x01
+        self.unlocked = set()
+        self._seed = {}  # level -> outstanding seed
+        self._download = None  # [address, length, data, next_seq, decompress]
+        self.link_bitrate = self.link_rates[0] if self.link_rates else None
+        self._link_pending = None  # verified rate awaiting the transition
+
+    # ── thread / bus lifetime ────────────────────────────────────
+    def start(self) -> "VirtualEcu":
+        self._bus = can.Bus(interface="virtual", channel=self.channel)
+        super().start()
+        return self
+
+    def stop(self):
+        self._halt.set()
+        if self.is_alive():
+            self.join(2.0)
+        if self._bus is not None:
+            self._bus.shutdown()
+            self._bus = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def run(self):
+        while not self._halt.is_set():
+            msg = self._bus.recv(0.1)
+            if msg is None or msg.arbitration_id != self.rx_id:
+                continue
+            try:
+                request = self._receive_request(msg)
+                if request:
+                    self._serve(request)
+            except VirtualEcuError as e:
+                print(f"[WARN] Virtual ECU: {e}")
+
+    # ── ISO-TP (ECU side) ────────────────────────────────────────
+    def _send(self, data):
+        data = bytes(data)
+        size = fd_frame_length(max(len(data), 8)) if self.fd else 8
+        data += bytes([self.padding]) * (size - len(data))
+        self._bus.send(
+            can.Message(
+                arbitration_id=self.tx_id,
+                data=data,
+                is_extended_id=False,
+                is_fd=self.fd,
+                bitrate_switch=self.fd,
+            )
+        )
+
+    def _recv_frame(self, timeout: float = 1.0) -> can.Message:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise VirtualEcuError("timeout waiting for tester frame")
+            msg = self._bus.recv(remaining)
+            if msg is not None and msg.arbitration_id == self.rx_id:
+                return msg
+
+    def _receive_request(self, first: can.Message) -> Optional[bytes]:
+        d = first.data
+        pci = d[0] >> 4
+        if pci == 0x0:
+            if d[0] == 0x00 and len(d) > 8:  # FD escape SF
+                return bytes(d[2 : 2 + d[1]])
+            return bytes(d[1 : 1 + (d[0] & 0x0F)])
+        if pci != 0x1:
+            return None  # stray CF/FC
+
+        total = ((d[0] & 0x0F) << 8) | d[1]
+        start = 2
+        if total == 0:  # escape FF, 32-bit length
+            total, start = int.from_bytes(d[2:6], "big"), 6
+        data = bytearray(d[start:])
+        min_gap = self._decode_stmin(self.stmin)
+        seq = 1
+        for _ in range(self.fc_waits):
+            self._send([0x31, 0x00, 0x00])
+            time.sleep(self.wait_interval)
+        while len(data) < total:
+            self._send([0x30, self.bs, self.stmin])
+            last_ts = None
+            received = 0
+            while len(data) < total and (self.bs == 0 or received < self.bs):
+                cf = self._recv_frame()
+                if cf.data[0] >> 4 != 0x2 or cf.data[0] & 0x0F != seq:
+                    raise VirtualEcuError(
+                        f"expected CF seq {seq}, got {cf.data[0]:02X}"
+                    )
+                if last_ts is not None and cf.timestamp - last_ts < min_gap * 0.9:
+                    self.stmin_violations += 1
+                last_ts = cf.timestamp
+                data += cf.data[1:]
+                seq = (seq + 1) & 0x0F
+                received += 1
+        return bytes(data[:total])
+
+    @staticmethod
+    def _decode_stmin(raw: int) -> float:
+        if raw <= 0x7F:
+            return raw / 1000
+        if 0xF1 <= raw <= 0xF9:
+            return (raw - 0xF0) / 10000
+        return 0x7F / 1000
+
+    def _send_response(self, payload: bytes):
+        if len(payload) <= 7:
+            self._send(bytes([len(payload)]) + payload)
+            return
+        if len(payload) <= self.frame_len - 2:
+            self._send(bytes([0x00, len(payload)]) + payload)
+            return
+        pci = IsoTpHandler.first_frame_pci(len(payload))
+        head = self.frame_len - len(pci)
+        self._send(pci + payload[:head])
+        fc = self._recv_frame()
+        if fc.data[0] != 0x30:
+            raise VirtualEcuError(f"expected FC CTS, got {fc.data[0]:02X}")
+        bs, stmin = fc.data[1], self._decode_stmin(fc.data[2])
+        per_cf = self.frame_len - 1
+        rest, seq, sent = payload[head:], 1, 0
+        while rest:
+            if bs and sent == bs:
+                fc = self._recv_frame()
+                sent = 0
+            self._send(bytes([0x20 | seq]) + rest[:per_cf])
+            rest, seq, sent = rest[per_cf:], (seq + 1) & 0x0F, sent + 1
+            if stmin:
+                time.sleep(stmin)
+
+    # ── services ─────────────────────────────────────────────────
+    def _serve(self, req: bytes):
+        self.requests.append((time.time(), req))
+        sid = req[0]
+        delay = self.service_latency.get(sid, self.latency)
+        if delay:
+            time.sleep(delay)
+
+        fault = self._faults.get(sid)
+        if fault:
+            nrc, fault[1] = fault[0], fault[1] - 1
+            if fault[1] <= 0:
+                del self._faults[sid]
+            if nrc is not None:
+                self._send_response(bytes([0x7F, sid, nrc]))
+            return
+
+        for _ in range(self.pending.get(sid, 0)):
+            self._send_response(bytes([0x7F, sid, 0x78]))
+            time.sleep(self.wait_interval)
+
+        handler = self._SERVICES.get(sid)
+        try:
+            if handler is None:
+                raise _Nrc(NRC_SERVICE_NOT_SUPPORTED)
+            resp = handler(self, req)
+        except _Nrc as e:
+            resp = bytes([0x7F, sid, e.nrc])
+        except (IndexError, ValueError):
+            resp = bytes([0x7F, sid, NRC_INCORRECT_LENGTH])
+        if resp is not None:
+            self._send_response(resp)
+
+    def _session_control(self, req):
+        if req[1] not in (0x01, 0x02, 0x03):
+            raise _Nrc(NRC_SUBFUNCTION_NOT_SUPPORTED)
+        if req[1] != self.session:
+            self.unlocked.clear()
+            self._seed.clear()
+        self.session = req[1]
+        # P2 = 50 ms, P2* = 5000 ms (in 10 ms units)
+        return bytes([0x50, req[1], 0x00, 0x32, 0x01, 0xF4])
+
+    def _ecu_reset(self, req):
+        if req[1] == 0x01:
+            self._reset_state()
+        elif req[1] != 0x60:
+            # 0x60: jump to bootloader, programming state is kept
+            raise _Nrc(NRC_SUBFUNCTION_NOT_SUPPORTED)
+        return bytes([0x51, req[1]])
+
+    def _security_access(self, req):
+        sub = req[1]
+        if sub % 2:  # request seed
+            if sub not in self.security.levels:
+                raise _Nrc(NRC_SUBFUNCTION_NOT_SUPPORTED)
+            seed = os.urandom(16)
+            self._seed[sub] = seed
+            return bytes([0x67, sub]) + seed
+        level = sub - 1
+        seed = self._seed.pop(level, None)
+        if seed is None:
+            raise _Nrc(NRC_REQUEST_SEQUENCE_ERROR)
+        expected = self.security.key(seed, level)
+        if expected is None or bytes(req[2:]) != expected:
+            raise _Nrc(NRC_INVALID_KEY)
+        self.unlocked.add(level)
+        return bytes([0x67, sub])
+
+    def _require_unlocked(self):
+        if 0x01 not in self.unlocked:
+            raise _Nrc(NRC_SECURITY_ACCESS_DENIED)
+
+    @staticmethod
+    def _addr_len(record: bytes):
+        # [0x44][address:4][length:4]...
+        if record[0] != 0x44:
+            raise _Nrc(NRC_REQUEST_OUT_OF_RANGE)
+        return int.from_bytes(record[1:5], "big"), int.from_bytes(record[5:9], "big")
+
+    def _routine_control(self, req):
+        routine = int.from_bytes(req[2:4], "big")
+        if req[1] != 0x01:
+            raise _Nrc(NRC_SUBFUNCTION_NOT_SUPPORTED)
+        if routine == 0xFF00:
+            self._require_unlocked()
+            address, length = self._addr_len(req[4:13])
+            for start in list(self.memory):
+                if start < address + length and address < start + len(self.memory[start]):
+                    del self.memory[start]
+            status = 0x00
+        elif routine == 0xFF01:
+            address, length = self._addr_len(req[4:13])
+            crc = int.from_bytes(req[13:15], "big")
+            data = self.memory.get(address)
+            ok = data is not None and len(data) == length
+            status = 0x00 if ok and crc16_ccitt_8408(data) == crc else 0x01
+        else:
+            raise _Nrc(NRC_REQUEST_OUT_OF_RANGE)
+        return bytes([0x71, 0x01]) + req[2:4] + bytes([status])
+
+    def _request_download(self, req):
+        self._require_unlocked()
+        fmt = req[2]
+        alen, llen = fmt & 0x0F, fmt >> 4
+        address = int.from_bytes(req[3 : 3 + alen], "big")
+        length = int.from_bytes(req[3 + alen : 3 + alen + llen], "big")
+        if req[1] and req[1] not in self.formats:
+            raise _Nrc(NRC_REQUEST_OUT_OF_RANGE)
+        if not length:
+            raise _Nrc(NRC_UPLOAD_DOWNLOAD_NOT_ACCEPTED)
+        self._download = [address, length, bytearray(), 1, self.formats.get(req[1])]
+        mbl = self.max_block_length
+        return bytes([0x74, 0x20]) + mbl.to_bytes(2, "big")
+
+    def _transfer_data(self, req):
+        dl = self._download
+        if dl is None:
+            raise _Nrc(NRC_REQUEST_SEQUENCE_ERROR)
+        if len(req) > self.max_block_length:
+            raise _Nrc(NRC_INCORRECT_LENGTH)
+        seq = req[1]
+        if seq == (dl[3] - 1) & 0xFF:
+            return bytes([0x76, seq])  # repeated request: already stored
+        if seq != dl[3]:
+            raise _Nrc(NRC_WRONG_BLOCK_SEQUENCE_COUNTER)
+        if not dl[4] and len(dl[2]) + len(req) - 2 > dl[1]:
+            raise _Nrc(NRC_TRANSFER_DATA_SUSPENDED)
+        dl[2] += req[2:]
+        dl[3] = (seq + 1) & 0xFF
+        return bytes([0x76, seq])
+
+    def _transfer_exit(self, req):
+        dl = self._download
+        if dl is None:
+            raise _Nrc(NRC_REQUEST_SEQUENCE_ERROR)
+        data = dl[2]
+        if dl[4]:
+            try:
+                data = bytearray(dl[4](bytes(data)))
+            except Exception:
+                raise _Nrc(NRC_GENERAL_PROGRAMMING_FAILURE)
+        if len(data) != dl[1]:
+            raise _Nrc(NRC_REQUEST_SEQUENCE_ERROR)
+        self.memory[dl[0]] = data
+        self._download = None
+        return bytes([0x77])
+
+    def _read_did(self, req):
+        resp = bytearray([0x62])
+        for i in range(1, len(req) - 1, 2):
+            did = int.from_bytes(req[i : i + 2], "big")
+            if did not in self.dids:
+                raise _Nrc(NRC_REQUEST_OUT_OF_RANGE)
+            resp += req[i : i + 2] + self.dids[did]
+        if len(resp) == 1:
+            raise _Nrc(NRC_INCORRECT_LENGTH)
+        return bytes(resp)
+
+    def _read_memory(self, req):
+        fmt = req[1]
+        alen, slen = fmt & 0x0F, fmt >> 4
+        address = int.from_bytes(req[2 : 2 + alen], "big")
+        size = int.from_bytes(req[2 + alen : 2 + alen + slen], "big")
+        if len(req) != 2 + alen + slen or not size:
+            raise _Nrc(NRC_INCORRECT_LENGTH)
+        for start, data in self.memory.items():
+            if start <= address and address + size <= start + len(data):
+                off = address - start
+                return bytes([0x63]) + bytes(data[off : off + size])
+        raise _Nrc(NRC_REQUEST_OUT_OF_RANGE)
+
+    def _clear_dtc(self, req):
+        return bytes([0x54])
+
+    def _read_dtc(self, req):
+        return bytes([0x59, req[1], 0xFF])
+
+    def _tester_present(self, req):
+        return None if req[1] & 0x80 else bytes([0x7E, req[1]])
+
+    def _control_dtc(self, req):
+        return bytes([0xC5, req[1]])
+
+    def _link_control(self, req):
+        sub = req[1] & 0x7F
+        if sub == 0x03:
+            if self._link_pending is None:
+                raise _Nrc(NRC_REQUEST_SEQUENCE_ERROR)
+            self.link_bitrate, self._link_pending = self._link_pending, None
+            return None if req[1] & 0x80 else bytes([0xC7, req[1]])
+        if sub == 0x01:
+            rate = LINK_MODES.get(req[2])
+        elif sub == 0x02:
+            if len(req) != 5:
+                raise _Nrc(NRC_INCORRECT_LENGTH)
+            rate = int.from_bytes(req[2:5], "big")
+        else:
+            raise _Nrc(NRC_SUBFUNCTION_NOT_SUPPORTED)
+        if rate not in self.link_rates:
+            raise _Nrc(NRC_REQUEST_OUT_OF_RANGE)
+        self._link_pending = rate
+        return bytes([0xC7, req[1]])
+
+    _SERVICES = {
+        0x10: _session_control,
+        0x11: _ecu_reset,
+        0x14: _clear_dtc,
+        0x19: _read_dtc,
+        0x22: _read_did,
+        0x23: _read_memory,
+        0x27: _security_access,
+        0x31: _routine_control,
+        0x34: _request_download,
+        0x36: _transfer_data,
+        0x37: _transfer_exit,
+        0x3E: _tester_present,
+        0x85: _control_dtc,
+        0x87: _link_control,
+    }
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import sys
+
+    from Flashing.flash_session import FlashSession
+    from Flashing.image_cache import load_cached
+
+    # Full preflash/program/postflash cycle against the simulator:
+    # python -m Flashing.virtual_ecu <mot_file>
+    mot_file = sys.argv[1] if len(sys.argv) > 1 else "N6060929_02 1.mot"
+    image = load_cached(mot_file)
+    with VirtualEcu(channel="vcan0") as ecu:
+        with FlashSession(interface="virtual", channel="vcan0") as session:
+            log = io.StringIO()
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(log):
+                pre = session.preflash()
+                ok, message = session.program(image)
+                post = session.postflash()
+            elapsed = time.perf_counter() - t0
+    print(f"preflash={pre} program={ok} ({message}) postflash={post}")
+    print(f"{len(ecu.requests)} requests in {elapsed:.2f} s")
+    for start, length in image.blocks():
+        held = ecu.memory.get(start)
+        match = held is not None and held == b"".join(
+            image.iter_chunks(start, length, 1 << 16)
+        )
+        print(f"block 0x{start:08X} ({length} bytes): {'OK' if match else 'MISMATCH'}")
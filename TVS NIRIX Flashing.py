@@ -31,6 +31,9 @@ import usb.core
 import usb.util
 from contextlib import redirect_stdout, redirect_stderr
 
+# Minimum time between two flashing progress signals (seconds)
+FLASH_PROGRESS_INTERVAL = 0.075
+
 class TestWorker(QObject):
     result_ready = pyqtSignal(object, float, str)
     error_occurred = pyqtSignal(Exception, float, str)
@@ -237,26 +240,147 @@ def load_station_config():
     return config_data
 
 class FlashingWorker(QObject):
-    progress_changed = pyqtSignal(int, str)  # percentage, status text
-    flashing_done = pyqtSignal(bool, str)    # success, message
-    flashing_error = pyqtSignal(str)
+    """
+    Flashing step on its own QThread: prepared firmware, block program loop,
+    checkpoint and readback settings from station.ini. Per-chunk progress
+    is coalesced to at most one progress_changed every
+    FLASH_PROGRESS_INTERVAL seconds (the last chunk of a block always
+    passes), so the GUI thread never paces the CAN traffic.
+    """
+    blocks_ready = pyqtSignal(int)                # number of blocks
+    progress_changed = pyqtSignal(int, int, int)  # block index, chunks done, total chunks
+    flashing_done = pyqtSignal(bool, str)         # success, message
+
+    def __init__(self, get_prefetcher, sku, vin, log_callback):
+        super().__init__()
+        self.get_prefetcher = get_prefetcher
+        self.sku = sku
+        self.vin = vin
+        self.log_callback = log_callback
 
     def run(self):
+        stream = EmittingStream(self.log_callback)
+        with redirect_stdout(stream), redirect_stderr(stream):
+            success, message = self.flash()
+        self.flashing_done.emit(success, message)
+
+    def flash(self):
+        try:
+            sys.path.insert(0, r'D:\TVS_NIRIX_Flashing')
+
+            from Flashing.find_addr_len import find_addr_len
+            from Flashing.flash_session import get_session
+            from Flashing.checkpoint import CHECKPOINT_DIRNAME, open_checkpoint
+            from Flashing.orchestrator import throttle_progress
+        except ImportError as e:
+            return False, f"Import error: {e}"
+
         try:
-            total_steps = 10
-            for step in range(total_steps):
-                # Simulate work
-                time.sleep(0.5)
+            station_config = load_station_config()
+            prefetcher = self.get_prefetcher()
 
-                percent = int((step + 1) / total_steps * 100)
-                status = f"Flashing step {step + 1} of {total_steps}..."
-                self.progress_changed.emit(percent, status)
+            # Firmware registered for this SKU, normally prepared in the
+            # background since the SKU was fetched: decoded from the station
+            # cache, small gaps merged / sectors aligned as station.ini asks
+            # and every block CRC computed. S-record, Intel HEX, VBF and raw
+            # .bin (loaded at bin_base_address) files are all accepted
+            mot_file, image = prefetcher.get(self.sku)
 
-            # Simulate success
-            self.flashing_done.emit(True, "Flashing completed successfully.")
+            # Get list of (start_address, length) for each block
+            blocks = find_addr_len(image)
+            if not blocks:
+                return False, "No blocks found for flashing"
+            self.blocks_ready.emit(len(blocks))
+
+            # Step 2 — Erase, download and validate every block on the bus
+            # session Preflashing opened; it stays open until Postflashing
+            # differential_flashing = 1 in station.ini skips blocks the ECU
+            # already holds (checked by CRC before erase)
+            differential = station_config.get(
+                "differential_flashing", "0"
+            ).strip().lower() in ("1", "true", "yes")
+            # Blocks already verified for this VIN (interrupted earlier cycle)
+            # are skipped; a failing block is retried before giving up
+            checkpoint = open_checkpoint(
+                self.vin,
+                image,
+                os.path.join(os.path.dirname(mot_file), CHECKPOINT_DIRNAME),
+            )
+            retries = int(station_config.get("flash_block_retries", "1"))
+            # readback_verify = 1 reads every programmed block back (0x23)
+            # and compares it byte for byte with the image
+            verify = station_config.get(
+                "readback_verify", "0"
+            ).strip().lower() in ("1", "true", "yes")
+            # link_bitrate = 1000000 downloads at 1 Mbit/s when the ECU
+            # accepts 0x87 LinkControl; the original rate is restored before
+            # Postflashing. 0 keeps the bus at its configured rate
+            link_bitrate = int(station_config.get("link_bitrate", "0") or 0)
+            # compression = zlib (or lzma) downloads blocks compressed, as
+            # prepared with the image, where the bootloader accepts the
+            # dataFormatIdentifier; empty sends every byte as is
+            compression = station_config.get("compression", "").strip() or None
+            session = get_session()
+            with session.link_speed(link_bitrate):
+                success, message = session.program(
+                    image,
+                    progress=throttle_progress(
+                        self.progress_changed.emit, FLASH_PROGRESS_INTERVAL
+                    ),
+                    differential=differential,
+                    checkpoint=checkpoint,
+                    retries=retries,
+                    verify=verify,
+                    compression=compression,
+                )
+            return success, "True" if success else message
 
         except Exception as e:
-            self.flashing_error.emit(str(e))
+            return False, f"Flashing process failed: {str(e)}"
+
+# Rows that program the ECU; all pass as is when it already runs the
+# SKU's target software (see SwCheckWorker)
+FLASH_STEPS = ("preflashing", "flashing", "postflashing")
+
+class SwCheckWorker(QObject):
+    """
+    skip_if_current check on its own QThread, run before Preflashing: the
+    SKU's target software / part number is compared with what the ECU
+    application reports (one multi-DID 0x22 read), before any security
+    access or bootloader entry.
+    """
+    checked = pyqtSignal(bool)  # True: software current, flashing rows pass
+
+    def __init__(self, get_prefetcher, sku, log_callback):
+        super().__init__()
+        self.get_prefetcher = get_prefetcher
+        self.sku = sku
+        self.log_callback = log_callback
+
+    def run(self):
+        stream = EmittingStream(self.log_callback)
+        with redirect_stdout(stream), redirect_stderr(stream):
+            current = self.check()
+        self.checked.emit(current)
+
+    def check(self):
+        try:
+            sys.path.insert(0, r'D:\TVS_NIRIX_Flashing')
+            from Flashing.flash_session import get_session
+
+            station_config = load_station_config()
+            if station_config.get(
+                "skip_if_current", "1"
+            ).strip().lower() not in ("1", "true", "yes"):
+                return False
+            expected = self.get_prefetcher().registry.expected_identification(self.sku)
+            if not expected or not get_session().software_current(expected):
+                return False
+            print("[INFO] ECU software is current, flashing steps skipped")
+            return True
+        except Exception as e:
+            print(f"[WARN] Software check not run: {e}")
+            return False
 
 class FlashingProgressDialog(QDialog):
     def __init__(self, parent=None):
@@ -1000,6 +1124,8 @@ class MainWindow(QWidget):
         super().__init__()
         self.cycle_time_box = CycleTimeBox()
         self.sku = None
+        self.firmware_prefetcher = None
+        self.software_current = None  # SwCheckWorker result for this cycle
         self.test_cycle_completed = False
         self.test_boxes = []
         self.sku_fetched.connect(self.on_sku_fetched)
@@ -1017,6 +1143,26 @@ class MainWindow(QWidget):
         header_bar = HeaderBar(resource_path("TVS logo white.png"))
 
         log_folder = resource_path(r"D:\TVS NIRIX Flashing\test_results")
+        # CAN traces go next to the test logs, so log_deletion_days applies
+        # to them too
+        try:
+            sys.path.insert(0, r'D:\TVS_NIRIX_Flashing')
+            from UDS.trace import configure_trace
+
+            configure_trace(log_folder)
+        except ImportError as e:
+            print(f"[WARN] CAN trace folder not set: {e}")
+        # CAN FD per ECU from station.ini (can_fd, can_frame_len,
+        # can_fd_timing, each overridable with a _<ecu> suffix): the flashing
+        # session takes the "flash" ECU's, 3W_Diagnostics scripts their own
+        try:
+            from UDS.bus_config import BusConfigError, bus_settings, configure_bus
+            from Flashing.flash_session import configure_session
+
+            configure_bus(load_station_config())
+            configure_session(**bus_settings("flash"))
+        except (ImportError, BusConfigError) as e:
+            print(f"[WARN] CAN FD settings not applied: {e}")
         try:
             log_cleanup_module = importlib.import_module("log_cleanup")
             log_cleanup_module.cleanup_old_logs(log_folder)
@@ -1523,6 +1669,16 @@ class MainWindow(QWidget):
         self.test_failed = False
         self.test_table.verticalScrollBar().setValue(0)
         importlib.invalidate_caches()
+        # Release the flashing session's bus before its modules are dropped
+        flash_session = sys.modules.get("Flashing.flash_session")
+        if flash_session is not None:
+            flash_session.close_session()
+        # Its images are instances of the Flashing classes about to be
+        # dropped; the next cycle's modules would not recognise them
+        if self.firmware_prefetcher is not None:
+            self.firmware_prefetcher.close()
+            self.firmware_prefetcher = None
+        self.software_current = None
         active_library = self.active_library_selector.get_selected_library()
         for module_name in list(sys.modules.keys()):
             if module_name.startswith(active_library):
@@ -1546,86 +1702,94 @@ class MainWindow(QWidget):
             print(f"Failed to shut down CAN bus: {e}")
         self.prepare_for_next_cycle()
         
-    def run_flashing_process(self, row):
-        """Run full flashing process in main GUI thread with multiple block progress bars."""
-        mot_file = r"D:\TVS NIRIX Flashing\N6060929_02 1.mot"
-    
-        # 1. Show flashing dialog
-        dialog = FlashingProgressDialog(self)
-    
-        # Step 1 — Get block info
-        try:
+    def get_firmware_prefetcher(self):
+        """Firmware registry + background preparer, created on first use."""
+        if self.firmware_prefetcher is None:
             sys.path.insert(0, r'D:\TVS_NIRIX_Flashing')
+            from Flashing.firmware_registry import FirmwarePrefetcher, FirmwareRegistry
 
-            from Flashing.find_addr_len import find_addr_len
-            from Flashing.flash_setup import flash_setup
-            from Flashing.flash_chunk import flash_chunk
-            from Flashing.flashing_done import flashing_done
-        except ImportError as e:
-            self._handle_flashing_result(False, f"Import error: {e}",row)
-            return
-    
+            station_config = load_station_config()
+            registry = FirmwareRegistry.from_config(
+                station_config,
+                resource_path(r"D:\TVS NIRIX Flashing\SKU_File_Mapping.xlsx"),
+            )
+            self.firmware_prefetcher = FirmwarePrefetcher(registry, station_config)
+        return self.firmware_prefetcher
+
+    def prefetch_firmware(self, sku):
         try:
-            # Get list of (start_address, length) for each block
-            blocks = find_addr_len(mot_file)  
-            total_blocks = len(blocks)
-            print(blocks)
-    
-            if total_blocks == 0:
-                self._handle_flashing_result(False, "No blocks found for flashing",row)
-                return
-    
-            # Initialize dialog with multiple progress bars — one per block
+            self.get_firmware_prefetcher().prefetch(sku)
+        except Exception as e:
+            # run_flashing_process prepares the image itself if this fails
+            print(f"[WARN] Firmware prefetch not started: {e}")
+
+    def run_software_check(self):
+        """Run SwCheckWorker, then continue with the current row."""
+        def on_checked(current):
+            self.software_current = current
+            self.run_next_test()
+
+        self.sw_check_thread = QThread()
+        self.sw_check_worker = SwCheckWorker(
+            self.get_firmware_prefetcher, self.sku, self.append_to_log_file
+        )
+        self.sw_check_worker.moveToThread(self.sw_check_thread)
+        self.sw_check_worker.checked.connect(on_checked)
+        self.sw_check_worker.checked.connect(self.sw_check_thread.quit)
+        self.sw_check_thread.started.connect(self.sw_check_worker.run)
+        self.sw_check_thread.finished.connect(self.sw_check_worker.deleteLater)
+        self.sw_check_thread.finished.connect(self.sw_check_thread.deleteLater)
+        self.sw_check_thread.start()
+
+    def skip_flash_step(self, row):
+        """Pass a flashing row without touching the ECU (software current)."""
+        self.result = True
+        self.test_duration = 0.0
+        self._continue_after_worker(row)
+        self.instruction_box.append("ECU software already current, step skipped")
+
+    def run_flashing_process(self, row):
+        """
+        Run the flashing step on a FlashingWorker thread. The GUI thread only
+        renders the worker's coalesced progress signals, so CAN timing does
+        not depend on repaints.
+        """
+        dialog = FlashingProgressDialog(self)
+
+        def on_blocks(total_blocks):
+            # one progress bar per block
             dialog.init_progress_bars(total_blocks)
             dialog.show()
-            QApplication.processEvents()
-    
-            # Step 2 — Loop through each block
-            for block_index, (start_addr, length) in enumerate(blocks):
-                QApplication.processEvents()
-    
-                # Get chunk details for this block
-                chunk_size, num_chunks = flash_setup(start_addr, length)
-    
-                if num_chunks <= 0:
-                    self._handle_flashing_result(False, f"Invalid chunk count for block {block_index + 1}", row)
-                    return
-    
-                # Step 3 — Flash each chunk in this block
-                chunk_counter = 0
-                success = True
-                crc_value = None
-                gen = flash_chunk(mot_file, start_addr, length, chunk_size)
-                for seq in gen:
-                    if isinstance(seq, bool):  # chunk progress
-                        chunk_counter += 1
-                        dialog.update_block_progress(block_index, chunk_counter, num_chunks)
-                        QApplication.processEvents()
-                    elif isinstance(seq, tuple) and seq[0] == "DONE":
-                        _, success, crc_value = seq  # final return (True, crc)
-                
-                if not success:
-                    self._handle_flashing_result(
-                        False, f"Flashing failed at block {block_index + 1}", row
-                    )
-                    dialog.reject()
-                    return
-                
-                # ✅ Step 3.5 — Run flash validation
-                if not flashing_done(start_addr, length, crc_value):
-                    self._handle_flashing_result(False, "Flash validation failed", row)
-                    dialog.reject()
-                    return
-    
-            # Step 4 — All blocks completed
-            dialog.accept()
-            self._handle_flashing_result(True, "True", row)
-            self.instruction_box.clear()
-            self.instruction_box.append("Flashing completed successfully")
-    
-        except Exception as e:
+
+        self.flash_thread = QThread()
+        self.flash_worker = FlashingWorker(
+            self.get_firmware_prefetcher,
+            self.sku,
+            self.vin_input.text().strip(),
+            self.append_to_log_file,
+        )
+        self.flash_worker.moveToThread(self.flash_thread)
+
+        self.flash_worker.blocks_ready.connect(on_blocks)
+        self.flash_worker.progress_changed.connect(dialog.update_block_progress)
+        self.flash_worker.flashing_done.connect(
+            lambda success, message: self._on_flashing_done(success, message, row, dialog)
+        )
+        self.flash_worker.flashing_done.connect(self.flash_thread.quit)
+        self.flash_thread.started.connect(self.flash_worker.run)
+        self.flash_thread.finished.connect(self.flash_worker.deleteLater)
+        self.flash_thread.finished.connect(self.flash_thread.deleteLater)
+        self.flash_thread.start()
+
+    def _on_flashing_done(self, success, message, row, dialog):
+        if not success:
             dialog.reject()
-            self._handle_flashing_result(False, f"Flashing process failed: {str(e)}", row)
+            self._handle_flashing_result(False, message, row)
+            return
+        dialog.accept()
+        self._handle_flashing_result(True, "True", row)
+        self.instruction_box.clear()
+        self.instruction_box.append("Flashing completed successfully")
     
     def _handle_flashing_result(self, success, message, row):
         """Update your main test logic with flashing results."""
@@ -2003,6 +2167,10 @@ class MainWindow(QWidget):
         self.on_sku_changed(sku)
         print(f"[DEBUG] SKU fetched: {sku} | Library: {active_library}")
         self.sku = sku
+        # Parse, plan and CRC this SKU's firmware while the earlier test
+        # steps (preflash, security access) run
+        if active_library == "Flashing":
+            self.prefetch_firmware(sku)
         test_file = resource_path(os.path.join("sku_files", f"{sku} - Flashing - details.xlsx"))
         print(f"Test file path: {test_file}")
         if not os.path.exists(test_file):
@@ -2161,6 +2329,17 @@ class MainWindow(QWidget):
             row = self.current_test_index
     
             self.retry_count = 0  # Reset retry count for this test
+
+            active_library = self.active_library_selector.get_selected_library()
+            if active_library == "Flashing" and function_name.lower() in FLASH_STEPS:
+                if self.software_current is None:
+                    # first flashing row: ECU identification is read in the
+                    # application, then this row runs (or passes) as usual
+                    self.run_software_check()
+                    return
+                if self.software_current:
+                    self.skip_flash_step(row)
+                    return
     
             if test_label.lower() == "flashing":  
                 # Special handling for flashing step
@@ -0,0 +1,10 @@
+"""
+Shared ISO-TP transport and UDS client used by the Flashing and
+3W_Diagnostics libraries.
+"""
+
+from UDS.isotp import IsoTpHandler
+from UDS.client import UdsHandler
+from UDS.trace import TraceWriter, render_text
+
+__all__ = ["IsoTpHandler", "UdsHandler", "TraceWriter", "render_text"]
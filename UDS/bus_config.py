@@ -0,0 +1,78 @@
+from typing import Optional
+
+from UDS.isotp import FD_LENGTHS
+
+# Station-wide CAN FD settings from station.ini [SETTINGS] (see configure_bus).
+# Every key may be overridden for one ECU with a _<ecu> suffix, e.g.
+#   can_fd = 0              classic CAN for every ECU
+#   can_fd_flash = 1        ...but ISO-TP over CAN FD for the flashed ECU
+#   can_frame_len = 64      TX_DL on FD buses (8, 12, 16, 20, 24, 32, 48, 64)
+#   can_fd_timing = f_clock_mhz=80, nom_brp=2, nom_tseg1=63, nom_tseg2=16,
+#                   nom_sjw=16, data_brp=2, data_tseg1=15, data_tseg2=4, data_sjw=4
+# can_fd_timing is passed to can.Bus as is (here PCAN's FD bit timing)
+_bus_settings = {}
+
+
+class BusConfigError(Exception):
+    pass
+
+
+def require(ok, msg: str):
+    """Raise on falsy result; return the value otherwise."""
+    if not ok:
+        raise BusConfigError(msg)
+    return ok
+
+
+def configure_bus(station_config: dict):
+    """Keep the station.ini settings bus_settings() answers from."""
+    _bus_settings.clear()
+    _bus_settings.update(
+        {
+            k.lower(): v
+            for k, v in station_config.items()
+            if k.lower().startswith("can_")
+        }
+    )
+
+
+def _setting(key: str, ecu: Optional[str]) -> str:
+    if ecu:
+        value = _bus_settings.get(f"{key}_{ecu.lower()}", "").strip()
+        if value:
+            return value
+    return _bus_settings.get(key, "").strip()
+
+
+def parse_timing(text: str) -> dict:
+    """'f_clock_mhz=80, nom_brp=2, ...' -> {"f_clock_mhz": 80, "nom_brp": 2, ...}"""
+    timing = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, sep, value = item.partition("=")
+        require(sep and name.strip(), f"Invalid can_fd_timing entry '{item}'")
+        try:
+            timing[name.strip()] = int(value.strip(), 0)
+        except ValueError:
+            raise BusConfigError(f"Invalid can_fd_timing value '{item}'") from None
+    return timing
+
+
+def bus_settings(ecu: Optional[str] = None) -> dict:
+    """
+    fd / frame_len / bus_kwargs for one ECU, as FlashSession, FlashJob and
+    configure_session() take them. Classic CAN unless station.ini enables FD.
+    """
+    fd = _setting("can_fd", ecu).lower() in ("1", "true", "yes")
+    if not fd:
+        return {"fd": False, "frame_len": None, "bus_kwargs": {}}
+    frame_len = _setting("can_frame_len", ecu)
+    if frame_len:
+        length = int(frame_len) if frame_len.isdigit() else 0
+        require(
+            length >= 8 and length in FD_LENGTHS, f"Invalid can_frame_len '{frame_len}'"
+        )
+    return {
+        "fd": True,
+        "frame_len": int(frame_len) if frame_len else None,
+        "bus_kwargs": parse_timing(_setting("can_fd_timing", ecu)),
+    }
@@ -0,0 +1,201 @@
+import time
+from typing import List, Optional
+
+from UDS.isotp import IsoTpHandler
+
+
+class UdsHandler:
+    """
+    UDS (ISO 14229) client for every service the station uses:
+    0x10, 0x11, 0x14, 0x19, 0x22, 0x23, 0x27, 0x31, 0x34, 0x36, 0x37, 0x3E, 0x85,
+    0x87.
+    Each call returns the positive response bytes, or None.
+    """
+
+    def __init__(
+        self, bus, tx_id, rx_id, timings=None, trace=None, fd=False, frame_len=None
+    ):
+        # fd=True: ISO-TP over CAN FD (64-byte frames unless frame_len says
+        # otherwise, bit-rate switch)
+        self.tp = IsoTpHandler(
+            bus, tx_id, rx_id, trace=trace, fd=fd, frame_len=frame_len
+        )
+        self.timings = timings or {"P2": 500, "P2*": 5000, "S3": 5000}
+        # P2 - WAIT TIME BTW REQ & RESP
+        # P2* - WAIT TIME BETWEEN RETRIES
+        # S3 - MAX WAIT TIME IN NON-DEFAULT SESS BTW REQ
+        # Every ECU-requested wait (0x78 pending, FC Wait) as
+        # (phase, kind, count, seconds), e.g. ("31 FF00", "pending", 3, 2.1)
+        self.waits = []
+
+    # 0x78 responses accepted for one request before treating it as lost
+    MAX_PENDING = 100
+
+    @staticmethod
+    def phase_name(req) -> str:
+        # routines are told apart by their id (31 FF00 erase, 31 FF01 validate)
+        if req[0] == 0x31 and len(req) >= 4:
+            return f"31 {req[2]:02X}{req[3]:02X}"
+        return f"{req[0]:02X}"
+
+    def request(self, req, positive_sid: int) -> Optional[List[int]]:
+        """Send one request and return the response if it is positive."""
+        self.tp.manual_transmit(req)
+        return self.receive(positive_sid, self.phase_name(req))
+
+    def receive(self, positive_sid: int, phase: str = "") -> Optional[List[int]]:
+        """
+        Wait for the response: P2 for the first answer, then P2* after each
+        NRC 0x78 (responsePending) until the final response arrives.
+        """
+        phase = phase or f"{positive_sid - 0x40:02X}"
+        if self.tp.fc_waits:
+            self._report_wait(phase, "FC wait", self.tp.fc_waits, self.tp.fc_wait_s)
+
+        timeout = self.timings["P2"] / 1000
+        pending = 0
+        started = time.perf_counter()
+        while True:
+            resp = self.tp.manual_receive(timeout)
+            if resp is not None or self.tp.last_nrc != 0x78:
+                break
+            pending += 1
+            if pending > self.MAX_PENDING:
+                print(f"[WARN] {phase}: no final response after {pending - 1} x 0x78")
+                break
+            timeout = self.timings["P2*"] / 1000
+        if pending:
+            self._report_wait(phase, "pending", pending, time.perf_counter() - started)
+        return resp if resp and resp[0] == positive_sid else None
+
+    def _report_wait(self, phase: str, kind: str, count: int, seconds: float):
+        self.waits.append((phase, kind, count, seconds))
+        print(f"[INFO] {phase} waited {seconds:.3f} s ({count} x {kind})")
+
+    def send_prepared(self, frames, positive_sid: int) -> Optional[List[int]]:
+        """Like request(), for frames already built by tp.prepare_frames()."""
+        self.tp.transmit_frames(frames)
+        return self.receive(positive_sid)
+
+    def diagnostic_session_control(
+        self, session_type: int = 0x03
+    ) -> Optional[List[int]]:
+        """0x10: Diagnostic Session Control, positive SID=0x50."""
+        return self.request([0x10, session_type], 0x50)
+
+    def ecu_reset(self, reset_type: int = 0x01) -> Optional[List[int]]:
+        """0x11: ECU Reset, positive SID=0x51."""
+        return self.request([0x11, reset_type], 0x51)
+
+    def clear_diagnostic_info(
+        self, group: Optional[int] = None
+    ) -> Optional[List[int]]:
+        """0x14: Clear Diagnostic Information, positive SID=0x54."""
+        req = [0x14] if group is None else [0x14] + list(group.to_bytes(3, "big"))
+        return self.request(req, 0x54)
+
+    def read_dtc_information(
+        self, report_type: int = 0x02, status_mask: int = 0xFF
+    ) -> Optional[List[int]]:
+        """0x19: Read DTC Information, positive SID=0x59."""
+        return self.request([0x19, report_type, status_mask], 0x59)
+
+    def request_seed(self, level: int = 0x01) -> Optional[bytes]:
+        """0x27: Security Access - Request Seed, positive SID=0x67."""
+        raw = self.request([0x27, level], 0x67)
+        return bytes(raw[2:]) if raw else None
+
+    def send_key(self, key: bytes, level: int = 0x01) -> Optional[List[int]]:
+        """0x27: Security Access - Send Key, positive SID=0x67."""
+        return self.request([0x27, level + 1] + list(key), 0x67)
+
+    def routine_control(
+        self, routine_id: int, sub_function: int = 0x01, parameter_record: bytes = b""
+    ) -> Optional[List[int]]:
+        """0x31: Routine Control, positive SID=0x71."""
+        req = (
+            [0x31, sub_function]
+            + list(routine_id.to_bytes(2, "big"))
+            + list(parameter_record)
+        )
+        return self.request(req, 0x71)
+
+    def request_download(
+        self,
+        address: int,  # starting memory address
+        size: int,  # size of data to download
+        data_format: int = 0x00,  # data format identifier
+        addr_len: int = 4,  # number of bytes to represent address
+        len_len: int = 4,  # number of bytes to represent length
+    ) -> Optional[List[int]]:
+        """0x34: Request Download, positive SID=0x74."""
+        fmt = (len_len << 4) | addr_len
+        addr_b = address.to_bytes(addr_len, "big")
+        size_b = size.to_bytes(len_len, "big")
+        req = [0x34, data_format, fmt] + list(addr_b) + list(size_b)
+        return self.request(req, 0x74)
+
+    def prepare_transfer_data(self, block_number: int, data) -> list:
+        """Framed 0x36 request, built ahead of time for a pipelined download."""
+        req = bytearray((0x36, block_number & 0xFF))
+        req += data
+        return self.tp.prepare_frames(req)
+
+    def transfer_data(self, block_number: int, data) -> Optional[List[int]]:
+        """0x36: Transfer Data, positive SID=0x76."""
+        return self.send_prepared(self.prepare_transfer_data(block_number, data), 0x76)
+
+    def read_data_by_identifier(self, *dids: int) -> Optional[bytes]:
+        """
+        0x22: Read Data By Identifier, positive SID=0x62. Several DIDs go in
+        one request; returns the records (DID + data, ...) after the SID.
+        """
+        req = [0x22]
+        for did in dids:
+            req += list(did.to_bytes(2, "big"))
+        raw = self.request(req, 0x62)
+        return bytes(raw[1:]) if raw else None
+
+    def read_memory_by_address(
+        self, address: int, size: int, addr_len: int = 4, size_len: int = 2
+    ) -> Optional[bytes]:
+        """0x23: Read Memory By Address, positive SID=0x63. Returns the data."""
+        fmt = (size_len << 4) | addr_len
+        req = (
+            [0x23, fmt]
+            + list(address.to_bytes(addr_len, "big"))
+            + list(size.to_bytes(size_len, "big"))
+        )
+        raw = self.request(req, 0x63)
+        return bytes(raw[1:]) if raw else None
+
+    def request_transfer_exit(self) -> Optional[List[int]]:
+        """0x37: Request Transfer Exit, positive SID=0x77."""
+        return self.request([0x37], 0x77)
+
+    def tester_present(self) -> Optional[List[int]]:
+        """0x3E: Tester Present, positive SID=0x7E."""
+        return self.request([0x3E, 0x00], 0x7E)
+
+    def control_dtc_settings(
+        self, setting_type: int = 0x02, dtc_setting_record: bytes = b""
+    ) -> Optional[List[int]]:
+        """0x85: Control DTC Settings, positive SID=0xC5."""
+        return self.request([0x85, setting_type] + list(dtc_setting_record), 0xC5)
+
+    def link_control(
+        self,
+        sub_function: int,
+        mode_id: Optional[int] = None,
+        baudrate: Optional[int] = None,
+    ) -> Optional[List[int]]:
+        """
+        0x87: Link Control, positive SID=0xC7. 0x01 verifies a fixed mode
+        (mode_id), 0x02 a specific baudrate, 0x03 makes the transition.
+        """
+        req = [0x87, sub_function]
+        if mode_id is not None:
+            req.append(mode_id)
+        if baudrate is not None:
+            req += list(baudrate.to_bytes(3, "big"))
+        return self.request(req, 0xC7)
@@ -0,0 +1,365 @@
+import time
+import can
+from typing import Optional
+
+from UDS.trace import get_trace_writer
+
+
+# Payload lengths a CAN FD frame can carry (DLC 0-15)
+FD_LENGTHS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64)
+
+
+def fd_frame_length(n: int) -> int:
+    """Smallest CAN FD frame length that holds n bytes (DLC rounding)."""
+    for length in FD_LENGTHS:
+        if length >= n:
+            return length
+    raise ValueError(f"{n} bytes do not fit in a CAN FD frame")
+
+
+class IsoTpHandler:
+    """
+    ISO-TP (ISO 15765-2) transport over classic CAN with 8-byte frames or,
+    with fd=True, CAN FD frames of up to 64 bytes (escape SF/FF, DLC
+    rounding, optional bit-rate switch). Every frame is built in a
+    preallocated buffer instead of new lists.
+    """
+
+    FRAME_LEN = 8  # classic CAN
+    FD_FRAME_LEN = 64
+    # FC Wait frames accepted in a row before giving up (WFTmax)
+    WFT_MAX = 10
+
+    def __init__(
+        self,
+        bus: can.Bus,
+        tx_id: int,
+        rx_id: int,
+        padding: int = 0x00,
+        trace=None,
+        fd: bool = False,
+        bitrate_switch: bool = True,
+        frame_len: Optional[int] = None,
+        wft_max: Optional[int] = None,
+    ):
+        self.bus = bus
+        self.tx_id = tx_id
+        self.rx_id = rx_id
+        self.padding = padding
+        # trace=None: shared background trace file; trace=False: no tracing
+        if trace is None:
+            trace = get_trace_writer()
+        self.trace = trace or None
+        self.fd = fd
+        self.bitrate_switch = fd and bitrate_switch
+        # TX_DL: bytes per frame we send (8 classic, 12..64 FD)
+        self.frame_len = frame_len or (self.FD_FRAME_LEN if fd else self.FRAME_LEN)
+        if self.frame_len not in FD_LENGTHS or self.frame_len < 8:
+            raise ValueError(f"Invalid ISO-TP frame length {self.frame_len}")
+        if not fd and self.frame_len != self.FRAME_LEN:
+            raise ValueError("Frames longer than 8 bytes need fd=True")
+        self._frame = bytearray([padding] * self.frame_len)
+        self.wft_max = self.WFT_MAX if wft_max is None else wft_max
+        # NRC of the last negative response manual_receive() returned None for
+        self.last_nrc: Optional[int] = None
+        # FC Wait frames and time spent in them during the last transmit
+        self.fc_waits = 0
+        self.fc_wait_s = 0.0
+
+    def frame_size(self, n: int) -> int:
+        """Length of a frame carrying n bytes: 8 classic, DLC-rounded FD."""
+        if not self.fd:
+            return self.FRAME_LEN
+        return fd_frame_length(max(n, 8))
+
+    # ── CAN-level primitives ─────────────────────────────────────
+    def _log_message(self, direction: str, msg: can.Message):
+        # Queued for the background trace writer; never touches disk or the
+        # console here. Render with `python -m UDS.trace` when needed.
+        if self.trace is not None:
+            msg.is_rx = direction == "[RX]"
+            self.trace.log(msg)
+
+    def send_raw_can(self, data):
+        # copy: can.Message keeps a bytearray by reference, and the frame
+        # buffer is reused before the trace writer logs the message
+        msg = can.Message(
+            timestamp=time.time(),
+            arbitration_id=self.tx_id,
+            data=bytes(data),
+            is_extended_id=False,
+            is_fd=self.fd,
+            bitrate_switch=self.bitrate_switch,
+        )
+        self._log_message("[TX]", msg)
+        try:
+            self.bus.send(msg)
+        except can.CanError as e:
+            print(f"[ERROR] CAN send failed: {e}")
+
+    def recv_raw_can(self, timeout: float = 2.0) -> Optional[can.Message]:
+        start = time.time()
+        while time.time() - start < timeout:
+            msg = self.bus.recv(timeout=min(0.3, timeout))
+            if msg:
+                self._log_message("[RX]", msg)
+                if msg.arbitration_id == self.rx_id:
+                    return msg
+        print("no message received")
+        return None
+
+    # ── ISO-TP framing helpers ────────────────────────────────────
+    def _fill(self, pci: bytes, payload, frame=None) -> bytearray:
+        """
+        Write PCI + payload into frame (default: the shared frame buffer,
+        only for frames sent at once by the thread that builds them) and pad
+        the rest.
+        """
+        if frame is None:
+            frame = self._frame
+        n = len(pci)
+        frame[:n] = pci
+        end = n + len(payload)
+        frame[n:end] = payload
+        size = self.frame_size(end)
+        frame[end:size] = bytes([self.padding]) * (size - end)
+        return frame if size == len(frame) else frame[:size]
+
+    @property
+    def max_single_frame(self) -> int:
+        """Largest payload sent as a Single Frame."""
+        return self.frame_len - 2 if self.frame_len > 8 else 7
+
+    def build_single_frame(self, payload, frame=None) -> bytearray:
+        if len(payload) <= 7:
+            # SF: lead nibble = 0x0, low nibble = length
+            return self._fill(bytes([len(payload) & 0x0F]), payload, frame)
+        # FD escape SF: 0x00, then the length in the second byte
+        return self._fill(bytes([0x00, len(payload)]), payload, frame)
+
+    @staticmethod
+    def first_frame_pci(total: int) -> bytes:
+        if total <= 0xFFF:
+            # FF: lead nibble = 0x1, low 12 bits = total length
+            return bytes([0x10 | ((total >> 8) & 0x0F), total & 0xFF])
+        # escape FF: 0x10 0x00 + 32-bit length
+        return bytes([0x10, 0x00]) + total.to_bytes(4, "big")
+
+    def build_first_frame(self, payload) -> bytearray:
+        pci = self.first_frame_pci(len(payload))
+        return self._fill(pci, payload[: self.frame_len - len(pci)])
+
+    def build_consecutive_frame(self, chunk, seq: int) -> bytearray:
+        # CF: lead nibble = 0x2, low nibble = sequence
+        return self._fill(bytes([0x20 | (seq & 0x0F)]), chunk)
+
+    def build_flow_control(
+        self, status: int = 0x30, bs: int = 0, stmin: int = 0
+    ) -> bytearray:
+        return self._fill(bytes([status, bs, stmin]), b"")
+
+    @staticmethod
+    def decode_stmin(stmin_raw: int) -> float:
+        if stmin_raw <= 0x7F:
+            return stmin_raw / 1000
+        if 0xF1 <= stmin_raw <= 0xF9:
+            return (stmin_raw - 0xF0) / 10000
+        return 0  # reserved values
+
+    @classmethod
+    def parse_flow_control(cls, msg: can.Message) -> tuple[int, float]:
+        if not msg or msg.data[0] != 0x30:
+            raise ValueError("[ERROR] No or invalid Flow Control Frame")
+        return msg.data[1], cls.decode_stmin(msg.data[2])
+
+    def _recv_flow_control(self, timeout: float = 2.0):
+        """
+        (bs, stmin) from the next FC; None if none/invalid arrived. FC Wait
+        (0x31) restarts the wait for the next FC, at most wft_max times.
+        """
+        waits = 0
+        wait_start = None
+        try:
+            while True:
+                fc = self.recv_raw_can(timeout)
+                if not fc or (fc.data[0] & 0xF0) != 0x30:
+                    return None
+                if fc.data[0] == 0x31:
+                    waits += 1
+                    if wait_start is None:
+                        wait_start = time.perf_counter()
+                    self.fc_waits += 1
+                    if waits > self.wft_max:
+                        raise RuntimeError(
+                            f"FC: Wait limit exceeded (WFTmax={self.wft_max})"
+                        )
+                    continue
+                if fc.data[0] == 0x32:
+                    raise RuntimeError("FC: Overflow (0x32) — ECU buffer full")
+                return self.parse_flow_control(fc)
+        finally:
+            # counted however the wait ends: CTS, timeout or WFTmax
+            if wait_start is not None:
+                self.fc_wait_s += time.perf_counter() - wait_start
+
+    # ── ISO-TP transport primitives ───────────────────────────────
+    # CF PCI bytes repeat every 16 frames: 0x21..0x2F, 0x20
+    _CF_PCI = bytes(0x20 | (k & 0x0F) for k in range(1, 17))
+
+    def build_multi_frames(self, payload) -> list:
+        """
+        Lay out FF + all CFs of a multi-frame payload in one padded buffer and
+        return them as frame-sized memoryview slices (no per-frame lists or
+        copies). The last CF of an FD transfer is cut to its rounded DLC.
+        """
+        total = len(payload)
+        step = self.frame_len
+        pci = self.first_frame_pci(total)
+        head = step - len(pci)  # payload bytes in the FF
+        per_cf = step - 1
+        n_cf = (total - head + per_cf - 1) // per_cf
+        buf = bytearray([self.padding]) * (step * (1 + n_cf))
+        buf[: len(pci)] = pci
+        buf[len(pci) : step] = payload[:head]
+        if n_cf:
+            # strided slice writes: one C-level copy per byte column, not a
+            # Python loop per CF (the last CF keeps its padding)
+            rest = bytes(payload[head:])
+            tail = len(rest) - (n_cf - 1) * per_cf  # bytes in the last CF
+            rest += bytes([self.padding]) * (n_cf * per_cf - len(rest))
+            pcis = self._CF_PCI * (n_cf // 16 + 1)
+            buf[step::step] = pcis[:n_cf]
+            for col in range(per_cf):
+                buf[step + 1 + col :: step] = rest[col::per_cf]
+        view = memoryview(buf)
+        frames = [view[i : i + step] for i in range(0, len(buf), step)]
+        if n_cf and self.fd:
+            frames[-1] = frames[-1][: self.frame_size(1 + tail)]
+        return frames
+
+    # Gaps shorter than this are busy-waited: time.sleep() on Windows rounds
+    # up to the 1–15 ms timer tick, far above 0xF1–0xF9 (100–900 µs) STmin.
+    SPIN_THRESHOLD = 0.002
+
+    @classmethod
+    def wait_until(cls, deadline: float):
+        """Block until time.perf_counter() reaches deadline."""
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return
+            if remaining > cls.SPIN_THRESHOLD:
+                time.sleep(remaining - cls.SPIN_THRESHOLD)
+
+    def prepare_frames(self, payload) -> list:
+        """All CAN frames of one request, ready for transmit_frames()."""
+        if len(payload) <= self.max_single_frame:
+            # own buffer: flash_chunk prepares requests on a producer thread
+            # while the sender builds Tester Present etc. in self._frame
+            frame = bytearray(self.frame_len)
+            return [self.build_single_frame(payload, frame)]
+        return self.build_multi_frames(payload)
+
+    def transmit_frames(self, frames: list, retry_limit: int = 3):
+        """Send frames from prepare_frames(), honouring the ECU's FC."""
+        self.fc_waits = 0
+        self.fc_wait_s = 0.0
+        # Single Frame
+        if len(frames) == 1:
+            self.send_raw_can(frames[0])
+            return
+
+        # Multi-Frame (First Frame + Consecutives)
+        for attempt in range(1, retry_limit + 1):
+            if attempt > 1:
+                print(f"[INFO] Sending First Frame (attempt {attempt})")
+            self.send_raw_can(frames[0])
+            fc = self._recv_flow_control()
+            if fc:
+                bs, stmin = fc
+                break
+            if attempt == retry_limit:
+                raise RuntimeError("No valid Flow Control received")
+
+        last = len(frames) - 1
+        block = 0
+        next_tx = 0.0
+        for index in range(1, last + 1):
+            # STmin is the minimum gap between CFs; 0 means back-to-back
+            if stmin:
+                self.wait_until(next_tx)
+            self.send_raw_can(frames[index])
+            next_tx = time.perf_counter() + stmin
+            block += 1
+            if bs and block >= bs and index < last:
+                fc = self._recv_flow_control()
+                if not fc:
+                    raise RuntimeError("Expected Flow Control but none received")
+                bs, stmin = fc
+                block = 0
+                next_tx = 0.0
+
+    def manual_transmit(self, payload, retry_limit: int = 3):
+        print(f"[INFO] Transmitting {len(payload)} bytes via ISO-TP")
+        self.transmit_frames(self.prepare_frames(payload), retry_limit)
+
+    def manual_receive(self, timeout: float = 2.0) -> Optional[list[int]]:
+        """
+        Receive a complete ISO-TP payload (handles SF or FF+CF).
+        Returns the raw payload bytes (no PCI) or None on timeout/error.
+        """
+        self.last_nrc = None
+        first = self.recv_raw_can(timeout)
+        if not first:
+            return None
+
+        pci_type = (first.data[0] & 0xF0) >> 4
+
+        # Single Frame (FD escape SF: 0x00 then the length byte)
+        if pci_type == 0x0:
+            length = first.data[0] & 0x0F
+            start = 1
+            if length == 0 and len(first.data) > 8:
+                length, start = first.data[1], 2
+            payload = first.data[start : start + length]
+            if len(payload) >= 3 and payload[0] == 0x7F:
+                self.last_nrc = payload[2]
+                # 0x78 responsePending is not an error; the UDS layer waits on
+                if payload[2] != 0x78:
+                    print(
+                        f"[UDS ERROR] Negative response: SID 0x{payload[1]:02X} "
+                        f"NRC 0x{payload[2]:02X}"
+                    )
+                return None
+            return list(payload)
+
+        # First Frame + Consecutives
+        elif pci_type == 0x1:
+            total = ((first.data[0] & 0x0F) << 8) + first.data[1]
+            start = 2
+            if total == 0:
+                # escape FF: 32-bit length
+                total, start = int.from_bytes(first.data[2:6], "big"), 6
+            data = bytearray(first.data[start:])
+            # send Flow-Control (CTS)
+            self.send_raw_can(self.build_flow_control())
+            seq = 1
+            while len(data) < total:
+                cf = self.recv_raw_can(timeout)
+                if not cf:
+                    return None
+                if (cf.data[0] & 0x0F) != seq:
+                    raise RuntimeError(
+                        f"Sequence mismatch: expected {seq}, got {cf.data[0] & 0x0F}"
+                    )
+                data += cf.data[1:]
+                seq = (seq + 1) % 16
+            return list(data[:total])
+
+        raise RuntimeError(f"Unknown PCI type {pci_type}")
+
+    def send_receive(self, request, timeout: float = 5.0) -> Optional[list[int]]:
+        # Short requests go as SF, longer ones as FF+CF
+        self.manual_transmit(request)
+        # Now receive the response (may be SF or MF)
+        return self.manual_receive(timeout)
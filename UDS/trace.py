@@ -0,0 +1,166 @@
+import atexit
+import os
+import queue
+import re
+import sys
+import threading
+from datetime import datetime
+from typing import Iterator, Optional
+
+import can
+
+DEFAULT_TRACE_NAME = "uds_trace"
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+# Trace files kept per name (rotated parts included); older ones are deleted
+DEFAULT_BACKUP_COUNT = 20
+
+# Folder and retention for new traces (see configure_trace)
+_trace_settings = {"folder": "logs", "backup_count": DEFAULT_BACKUP_COUNT}
+
+
+def configure_trace(folder: Optional[str] = None, backup_count: Optional[int] = None):
+    """
+    Where new traces go and how many are kept, e.g. the station's log folder
+    so log_cleanup's age limit applies to them as well.
+    """
+    if folder is not None:
+        _trace_settings["folder"] = folder
+    if backup_count is not None:
+        _trace_settings["backup_count"] = backup_count
+
+
+def trace_path(name: str = DEFAULT_TRACE_NAME, folder: Optional[str] = None) -> str:
+    """New trace file <folder>/<name>_<YYYYmmdd_HHMMSS_mmm>.blf (never reused)."""
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+    return os.path.join(folder or _trace_settings["folder"], f"{name}_{stamp}.blf")
+
+
+def _trace_files(folder: str, name: str):
+    """Trace files of name in folder, newest first."""
+    # <name>_<stamp>[_<rotation stamp>_#NNN].blf; other names that merely
+    # start with name (uds_trace_<channel>_...) do not match
+    pattern = re.compile(rf"{re.escape(name)}_\d{{8}}_\d{{6}}_\d{{3}}(_.+)?\.blf$")
+    try:
+        files = [
+            os.path.join(folder, f) for f in os.listdir(folder) if pattern.match(f)
+        ]
+    except OSError:
+        return []
+    return sorted(files, key=os.path.getmtime, reverse=True)
+
+
+def prune_traces(folder: str, name: str, keep: int):
+    """Delete all but the newest `keep` trace files of name in folder."""
+    for path in _trace_files(folder, name)[keep:]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"[WARN] Old CAN trace not deleted: {e}")
+
+
+class TraceWriter:
+    """
+    Background CAN trace. The transport only puts frames on a SimpleQueue
+    (never blocks, no lock held by the caller); a daemon thread writes them
+    as a compact BLF trace with size-based rotation. Each writer starts a new
+    timestamped file and keeps the newest backup_count files of its name.
+    """
+
+    def __init__(
+        self,
+        name: str = DEFAULT_TRACE_NAME,
+        folder: Optional[str] = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        backup_count: Optional[int] = None,
+    ):
+        self.name = name
+        self.path = trace_path(name, folder)
+        self.max_bytes = max_bytes
+        self.backup_count = (
+            _trace_settings["backup_count"] if backup_count is None else backup_count
+        )
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._run, name="uds-trace", daemon=True
+        )
+        self._thread.start()
+
+    def log(self, msg: can.Message):
+        self._queue.put(msg)
+
+    def _run(self):
+        try:
+            folder = os.path.dirname(self.path) or "."
+            os.makedirs(folder, exist_ok=True)
+            logger = can.SizedRotatingLogger(self.path, max_bytes=self.max_bytes)
+            # rotated parts count towards the limit, so prune on rollover too
+            # (the current file is recreated right after, hence one less)
+            def rotator(source, dest):
+                os.replace(source, dest)
+                prune_traces(folder, self.name, max(0, self.backup_count - 1))
+
+            logger.rotator = rotator
+            prune_traces(folder, self.name, self.backup_count)
+        except Exception as e:
+            print(f"[WARN] CAN trace disabled: {e}")
+            # keep draining so callers never pile up frames
+            while self._queue.get() is not None:
+                pass
+            return
+        try:
+            while True:
+                msg = self._queue.get()
+                if msg is None:
+                    break
+                logger.on_message_received(msg)
+        finally:
+            logger.stop()
+
+    def close(self, timeout: float = 5.0):
+        """Flush queued frames and close the trace file."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+
+_writer: Optional[TraceWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_trace_writer() -> TraceWriter:
+    """Process-wide trace writer, started on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = TraceWriter()
+            atexit.register(_writer.close)
+        return _writer
+
+
+def format_message(msg: can.Message) -> str:
+    direction = "[RX]" if msg.is_rx else "[TX]"
+    data_str = " ".join(f"{b:02X}" for b in msg.data)
+    return (
+        f"{msg.timestamp:.6f} {direction} ID=0x{msg.arbitration_id:X} "
+        f"DLC={msg.dlc} DATA={data_str}"
+    )
+
+
+def latest_trace(name: str = DEFAULT_TRACE_NAME, folder: Optional[str] = None):
+    """Path of the newest trace of name in folder; None if there is none."""
+    files = _trace_files(folder or _trace_settings["folder"], name)
+    return files[0] if files else None
+
+
+def render_text(path: str) -> Iterator[str]:
+    """Render a recorded trace as the old uds_log.txt style text lines."""
+    for msg in can.LogReader(path):
+        yield format_message(msg)
+
+
+if __name__ == "__main__":
+    trace_file = sys.argv[1] if len(sys.argv) > 1 else latest_trace()
+    if not trace_file:
+        raise SystemExit("usage: python -m UDS.trace [trace file] (no trace in logs/)")
+    for line in render_text(trace_file):
+        print(line)
@@ -0,0 +1,69 @@
+"""
+Compressed download benchmark on a python-can virtual bus: TransferData
+bytes and programming time for an image with erased (0xFF) gaps and
+repeated tables, downloaded as is and with every Flashing.compression
+method. The ECU memory is checked against the image after each run.
+
+    python -m benchmarks.bench_compression [size_bytes]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+from Flashing.compression import COMPRESSION_METHODS, compress_block
+from Flashing.flash_session import FlashSession
+from Flashing.segment_image import SegmentImage
+from Flashing.virtual_ecu import VirtualEcu
+
+CHANNEL = "bench_compression"
+BASE_ADDRESS = 0xFF200000
+
+
+def firmware_like(size: int) -> bytes:
+    # per 16 KiB: code (incompressible), a repeated lookup table, erased gap
+    table = bytes(range(256)) * 16
+    data = b"".join(
+        os.urandom(8192) + table + b"\xff" * 4096 for _ in range(size // 16384 + 1)
+    )
+    return data[:size]
+
+
+def download(image, compression):
+    with contextlib.redirect_stdout(io.StringIO()), VirtualEcu(
+        channel=CHANNEL, max_block_length=0xFFF
+    ) as ecu, FlashSession(interface="virtual", channel=CHANNEL, trace=False) as session:
+        ecu.session, ecu.unlocked = 0x02, set(ecu.security.levels)
+        t = time.perf_counter()
+        success, message = session.program(image, compression=compression)
+        elapsed = time.perf_counter() - t
+        if not success or any(
+            bytes(ecu.memory.get(start, b"")) != bytes(run)
+            for start, run in image.segments
+        ):
+            raise SystemExit(f"[FAIL] {compression or 'raw'} download: {message}")
+        sent = sum(len(req) - 2 for _, req in ecu.requests if req[0] == 0x36)
+    return sent, elapsed
+
+
+def main(size: int = 256 * 1024):
+    image = SegmentImage()
+    image.write(BASE_ADDRESS, firmware_like(size))
+    print(f"image: {size} bytes at 0x{BASE_ADDRESS:08X}")
+    for name in [None, *COMPRESSION_METHODS]:
+        prep = 0.0
+        if name:
+            t = time.perf_counter()
+            compress_block(image, BASE_ADDRESS, size, name)
+            prep = time.perf_counter() - t
+        sent, elapsed = download(image, name)
+        print(
+            f"{name or 'raw':<6} {sent:9d} bytes on the bus ({sent / size:4.0%})  "
+            f"download {elapsed * 1e3:8.1f} ms  compress {prep * 1e3:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 256 * 1024)
@@ -0,0 +1,61 @@
+"""
+Microbenchmark: CRC-16/0x8408 engines against the original bit-loop version
+that flash_chunk used to run per chunk.
+
+    python -m benchmarks.bench_crc16 [size_bytes]
+"""
+
+import os
+import sys
+import timeit
+
+from Flashing.crc16 import crc16_ccitt_8408, crc16_ccitt_8408_table
+
+
+def crc16_ccitt_8408_bitwise(data: bytes, initial: int = 0x0000) -> int:
+    # original flash_chunk implementation, kept as the reference
+    crc = initial
+    poly = 0x8408
+
+    for byte in data:
+        curr = byte
+        for _ in range(8):
+            if (crc & 0x0001) ^ (curr & 0x01):
+                crc = (crc >> 1) ^ poly
+            else:
+                crc >>= 1
+            curr >>= 1
+    return crc & 0xFFFF
+
+
+def main(size: int = 25014):
+    data = os.urandom(size)
+    engines = [
+        ("bitwise (old)", crc16_ccitt_8408_bitwise),
+        ("table", crc16_ccitt_8408_table),
+        ("crc_hqx reflected", crc16_ccitt_8408),
+    ]
+    expected = crc16_ccitt_8408_bitwise(data)
+    print(f"block size: {size} bytes, CRC=0x{expected:04X}")
+    base = None
+    for name, fn in engines:
+        if fn(data) != expected:
+            raise SystemExit(f"[FAIL] {name} CRC mismatch")
+        # incremental use must match the one-shot value
+        crc = 0
+        for off in range(0, size, 4093):
+            crc = fn(data[off : off + 4093], crc)
+        if crc != expected:
+            raise SystemExit(f"[FAIL] {name} incremental CRC mismatch")
+
+        runs = 3 if fn is crc16_ccitt_8408_bitwise else 50
+        t = min(timeit.repeat(lambda: fn(data), number=runs, repeat=3)) / runs
+        base = base or t
+        print(
+            f"{name:<20} {t * 1e3:9.3f} ms  {size / t / 1e6:8.2f} MB/s  "
+            f"x{base / t:,.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 25014)
@@ -0,0 +1,270 @@
+"""
+Flashing throughput benchmark against Flashing.virtual_ecu.
+
+For every maxNumberOfBlockLength x STmin combination the full program() loop
+(erase, RequestDownload, TransferData, TransferExit, validate) runs on a
+virtual bus and reports bytes/s, frames/s, the latency distribution per UDS
+service, the one-off block CRC cost and how the wall time splits into bus
+wait (inside bus.recv), bus send, STmin pacing and Python overhead. Results
+are written as JSON; --baseline compares throughput against an earlier
+result file.
+
+    python -m benchmarks.bench_flashing [--mot FILE] [--size BYTES]
+        [--block-lengths 0x82,0x402] [--stmin 0,0xF5,1] [--latency MS]
+        [--trace] [--fd] [--out bench_flashing.json] [--baseline OLD.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import can
+
+from Flashing import crc16
+from Flashing.flash_session import FlashSession
+from Flashing.segment_image import SegmentImage, as_image
+from Flashing.virtual_ecu import VirtualEcu
+
+CHANNEL = "bench_flashing"
+BASE_ADDRESS = 0xFF200080
+
+
+class _Probe:
+    """Times every UDS request by service and every bus send/recv call."""
+
+    def __init__(self, session):
+        self.latencies = {}
+        self.recv_s = 0.0
+        self.send_s = 0.0
+        self.pacing_s = 0.0
+        self.frames = 0
+        self._wrap_bus(session.bus)
+        self._wrap_uds(session.uds)
+        self._wrap_pacing(session.uds.tp)
+
+    def _wrap_bus(self, bus):
+        recv, send = bus.recv, bus.send
+
+        def timed_recv(timeout=None):
+            t = time.perf_counter()
+            msg = recv(timeout)
+            self.recv_s += time.perf_counter() - t
+            if msg is not None:
+                self.frames += 1
+            return msg
+
+        def timed_send(msg, timeout=None):
+            t = time.perf_counter()
+            send(msg, timeout)
+            self.send_s += time.perf_counter() - t
+            self.frames += 1
+
+        bus.recv, bus.send = timed_recv, timed_send
+
+    def _wrap_pacing(self, tp):
+        wait_until = tp.wait_until
+
+        def timed_wait_until(deadline):
+            t = time.perf_counter()
+            wait_until(deadline)
+            self.pacing_s += time.perf_counter() - t
+
+        tp.wait_until = timed_wait_until
+
+    def _wrap_uds(self, uds):
+        request, send_prepared = uds.request, uds.send_prepared
+
+        def timed_request(req, positive_sid):
+            t = time.perf_counter()
+            try:
+                return request(req, positive_sid)
+            finally:
+                self._record(uds.phase_name(req), time.perf_counter() - t)
+
+        def timed_send_prepared(frames, positive_sid):
+            t = time.perf_counter()
+            try:
+                return send_prepared(frames, positive_sid)
+            finally:
+                self._record(f"{positive_sid - 0x40:02X}", time.perf_counter() - t)
+
+        uds.request, uds.send_prepared = timed_request, timed_send_prepared
+
+    def _record(self, key, seconds):
+        self.latencies.setdefault(key, []).append(seconds)
+
+    def reset(self):
+        self.latencies.clear()
+        self.recv_s = self.send_s = self.pacing_s = 0.0
+        self.frames = 0
+
+
+def _distribution(samples):
+    ms = sorted(s * 1e3 for s in samples)
+    return {
+        "count": len(ms),
+        "total_ms": round(sum(ms), 3),
+        "mean_ms": round(statistics.fmean(ms), 4),
+        "p50_ms": round(ms[len(ms) // 2], 4),
+        "p95_ms": round(ms[max(0, int(len(ms) * 0.95) - 1)], 4),
+        "max_ms": round(ms[-1], 4),
+    }
+
+
+def run_case(image, max_block_length, stmin, latency_ms=0.0, trace=False, fd=False):
+    """One program() run; returns the result record for the JSON file."""
+    ecu = VirtualEcu(
+        channel=CHANNEL,
+        max_block_length=max_block_length,
+        stmin=stmin,
+        latency=latency_ms / 1000,
+        fd=fd,
+    )
+    session = FlashSession(
+        interface="virtual", channel=CHANNEL, trace=None if trace else False, fd=fd
+    )
+    with ecu, session, contextlib.redirect_stdout(io.StringIO()):
+        probe = _Probe(session)
+        if not session.preflash():
+            raise SystemExit("[FAIL] Preflashing against the virtual ECU failed")
+        probe.reset()
+        session.uds.waits.clear()
+        t0 = time.perf_counter()
+        success, message = session.program(image)
+        elapsed = time.perf_counter() - t0
+        waits = list(session.uds.waits)
+    if not success:
+        raise SystemExit(f"[FAIL] program(): {message}")
+
+    size = len(image)
+    python_s = elapsed - probe.recv_s - probe.send_s - probe.pacing_s
+    return {
+        "max_block_length": max_block_length,
+        "stmin": stmin,
+        "latency_ms": latency_ms,
+        "trace": trace,
+        "fd": fd,
+        "bytes": size,
+        "program_s": round(elapsed, 4),
+        "bytes_per_s": round(size / elapsed, 1),
+        "frames": probe.frames,
+        "frames_per_s": round(probe.frames / elapsed, 1),
+        "bus_wait_s": round(probe.recv_s, 4),
+        "bus_send_s": round(probe.send_s, 4),
+        "stmin_pacing_s": round(probe.pacing_s, 4),
+        "python_s": round(python_s, 4),
+        "python_share": round(python_s / elapsed, 3),
+        "stmin_violations": ecu.stmin_violations,
+        "services": {k: _distribution(v) for k, v in sorted(probe.latencies.items())},
+        "ecu_waits": [
+            {"phase": phase, "kind": kind, "count": count, "s": round(sec, 4)}
+            for phase, kind, count, sec in waits
+        ],
+    }
+
+
+def crc_cost(image):
+    """Seconds to compute every block CRC from scratch (cached at runtime)."""
+    t = time.perf_counter()
+    for start, length in image.blocks():
+        crc16.block_crc(image, start, length)
+    return round(time.perf_counter() - t, 6)
+
+
+def compare(results, baseline_path, tolerance):
+    """Print throughput regressions against an earlier result file."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def key(run):
+        return (
+            run["max_block_length"],
+            run["stmin"],
+            run["latency_ms"],
+            run["trace"],
+            run.get("fd", False),
+        )
+
+    old = {key(r): r for r in baseline.get("runs", [])}
+    regressions = 0
+    for run in results["runs"]:
+        ref = old.get(key(run))
+        if ref is None:
+            continue
+        ratio = run["bytes_per_s"] / ref["bytes_per_s"]
+        status = "OK"
+        if ratio < 1 - tolerance:
+            status = "REGRESSION"
+            regressions += 1
+        print(
+            f"[{status}] mbl=0x{run['max_block_length']:X} stmin=0x{run['stmin']:02X}: "
+            f"{ref['bytes_per_s']:.0f} -> {run['bytes_per_s']:.0f} B/s (x{ratio:.2f})"
+        )
+    return regressions
+
+
+def _int_list(text):
+    return [int(v, 0) for v in text.split(",") if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mot", help="firmware file (default: random image)")
+    parser.add_argument("--size", type=int, default=64 * 1024)
+    parser.add_argument("--block-lengths", type=_int_list, default=[0x82, 0x402, 0xFFF])
+    parser.add_argument("--stmin", type=_int_list, default=[0x00, 0xF5, 0x01])
+    parser.add_argument("--latency", type=float, default=0.0, help="ECU ms per response")
+    parser.add_argument("--trace", action="store_true", help="keep the BLF trace on")
+    parser.add_argument("--fd", action="store_true", help="ISO-TP over CAN FD")
+    parser.add_argument("--out", default="bench_flashing.json")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    if args.mot:
+        image = as_image(args.mot)
+    else:
+        image = SegmentImage()
+        image.write(BASE_ADDRESS, os.urandom(args.size))
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "python_can": can.__version__,
+        },
+        "image": {"source": args.mot or "random", "bytes": len(image),
+                  "blocks": len(image.blocks())},
+        "crc_s": crc_cost(image),
+        "runs": [],
+    }
+    print(f"image: {len(image)} bytes in {len(image.blocks())} block(s), "
+          f"CRC {results['crc_s'] * 1e3:.2f} ms")
+    for mbl in args.block_lengths:
+        for stmin in args.stmin:
+            run = run_case(image, mbl, stmin, args.latency, args.trace, args.fd)
+            results["runs"].append(run)
+            td = run["services"].get("36", {})
+            print(
+                f"mbl=0x{mbl:03X} stmin=0x{stmin:02X}  {run['bytes_per_s'] / 1024:8.1f} KiB/s  "
+                f"{run['frames_per_s']:8.0f} frames/s  0x36 p50 {td.get('p50_ms', 0):6.2f} ms  "
+                f"wait {run['bus_wait_s']:.3f} s  python {run['python_share']:.0%}"
+            )
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(f"[OK] results written to {args.out}")
+
+    if args.baseline:
+        if compare(results, args.baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
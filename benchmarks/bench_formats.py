@@ -0,0 +1,117 @@
+"""
+Parser benchmark: load_firmware() on the same multi-MB image written as
+S-record, Intel HEX, VBF and raw binary, plus the previous unvalidated
+line-by-line S-record parser for reference. Every loaded image is checked
+against the source bytes.
+
+    python -m benchmarks.bench_formats [size_bytes]
+"""
+
+import binascii
+import os
+import sys
+import tempfile
+import time
+import zlib
+
+from Flashing.firmware_formats import load_firmware
+from Flashing.segment_image import SegmentImage
+
+BASE_ADDRESS = 0xFF200000
+RECORD_BYTES = 32
+
+
+def load_srec_lines(path, base_address=None):
+    # previous load_srec: bytes.fromhex per line, no checksum validation
+    image = SegmentImage()
+    with open(path, "r", encoding="ascii", errors="strict") as f:
+        for line in f:
+            line = line.strip()
+            alen = {"1": 2, "2": 3, "3": 4}.get(line[1:2]) if line[:1] == "S" else None
+            if alen is None:
+                continue
+            payload = bytes.fromhex(line[2:])
+            addr = int.from_bytes(payload[1 : 1 + alen], "big")
+            image.write(addr, payload[1 + alen : -1])
+    return image
+
+
+def write_srec(path, base, data):
+    with open(path, "w", encoding="ascii", newline="\r\n") as f:
+        for off in range(0, len(data), RECORD_BYTES):
+            rec = bytearray([RECORD_BYTES + 5]) + (base + off).to_bytes(4, "big")
+            rec += data[off : off + RECORD_BYTES]
+            rec[0] = len(rec)
+            rec.append(~sum(rec) & 0xFF)
+            f.write(f"S3{rec.hex().upper()}\n")
+        f.write("S70500000000FA\n")
+
+
+def write_ihex(path, base, data):
+    upper = None
+    with open(path, "w", encoding="ascii", newline="\r\n") as f:
+        for off in range(0, len(data), RECORD_BYTES):
+            addr = base + off
+            if addr >> 16 != upper:
+                upper = addr >> 16
+                rec = bytearray([2, 0, 0, 4]) + upper.to_bytes(2, "big")
+                f.write(f":{(rec + bytes([-sum(rec) & 0xFF])).hex().upper()}\n")
+            chunk = data[off : off + RECORD_BYTES]
+            rec = bytearray([len(chunk)]) + (addr & 0xFFFF).to_bytes(2, "big")
+            rec += b"\x00" + chunk
+            f.write(f":{(rec + bytes([-sum(rec) & 0xFF])).hex().upper()}\n")
+        f.write(":00000001FF\n")
+
+
+def write_vbf(path, base, data):
+    body = base.to_bytes(4, "big") + len(data).to_bytes(4, "big") + data
+    body += binascii.crc_hqx(data, 0xFFFF).to_bytes(2, "big")
+    header = (
+        "vbf_version = 2.6;\n"
+        "header {\n"
+        '    // "}" in comments and strings must not end the header\n'
+        '    sw_part_number = "BENCH{01}";\n'
+        "    sw_part_type = EXE;\n"
+        f"    erase = {{ {{ 0x{base:08X}, 0x{len(data):08X} }} }};\n"
+        f"    file_checksum = 0x{zlib.crc32(body):08X};\n"
+        "}"
+    )
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii") + body)
+
+
+def write_bin(path, base, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def main(size: int = 4 * 1024 * 1024):
+    data = os.urandom(size)
+    cases = [
+        ("srec (old, unvalidated)", ".mot", write_srec, load_srec_lines),
+        ("srec", ".mot", write_srec, load_firmware),
+        ("ihex", ".hex", write_ihex, load_firmware),
+        ("vbf", ".vbf", write_vbf, load_firmware),
+        ("bin", ".bin", write_bin, load_firmware),
+    ]
+    print(f"image: {size} bytes at 0x{BASE_ADDRESS:08X}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, ext, writer, loader in cases:
+            path = os.path.join(tmp, f"bench{ext}")
+            writer(path, BASE_ADDRESS, data)
+            t = time.perf_counter()
+            image = loader(path, base_address=BASE_ADDRESS)
+            elapsed = time.perf_counter() - t
+            if image.blocks() != [(BASE_ADDRESS, size)] or bytes(
+                image.segments[0][1]
+            ) != data:
+                raise SystemExit(f"[FAIL] {name} image differs from the source")
+            file_mb = os.path.getsize(path) / 1e6
+            print(
+                f"{name:<24} {file_mb:7.2f} MB file  {elapsed * 1e3:8.1f} ms  "
+                f"{size / elapsed / 1e6:7.2f} MB/s image"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 4 * 1024 * 1024)
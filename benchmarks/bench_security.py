@@ -0,0 +1,117 @@
+"""
+Seed-to-key latency: the previous per-call setup (new AES cipher and hex
+key decode, DLL load + SedKeyGen_Init per seed) against the cached
+Flashing.security algorithms, plus the full 0x27 seed/key exchange with
+Flashing.virtual_ecu.
+
+    python -m benchmarks.bench_security [--dll PATH] [--rounds N]
+"""
+
+import argparse
+import contextlib
+import ctypes
+import io
+import os
+import statistics
+import time
+import timeit
+from ctypes import POINTER, c_int, c_ubyte
+
+from Crypto.Cipher import AES
+
+from Flashing.flash_session import FlashSession
+from Flashing.security import aes_seed_key, dll_seed_key
+from Flashing.virtual_ecu import VirtualEcu
+
+CHANNEL = "bench_security"
+
+
+def encrypt_seed_uncached(seed, level):
+    # previous Preflashing.encrypt_seed, without its prints
+    if level == 3:
+        prv_key = bytes.fromhex("E6AB4112C0FBD97834DAA6606FA45D65")
+    else:
+        prv_key = bytes.fromhex("DCDEE01FAB9D7AB77B49C9FFD075B364")
+    return AES.new(prv_key, AES.MODE_ECB).encrypt(seed)
+
+
+def dll_key_uncached(seed, dll_path, key_length=4, security_level=1):
+    # previous calculate_key_from_seed: load, prototype and init per seed
+    try:
+        lib = ctypes.CDLL(dll_path)
+    except OSError:
+        lib = ctypes.WinDLL(dll_path)
+    value = (security_level - 1) // 2
+    lib.SedKeyGen_Init.argtypes = [c_int]
+    lib.SedKeyGen_Init.restype = c_int
+    lib.SedKeyGen_Init(value)
+    func = lib.SedKeyGen_GetKey
+    func.argtypes = [c_int, POINTER(c_ubyte), POINTER(c_ubyte)]
+    func.restype = c_int
+    key = (c_ubyte * key_length)()
+    func(value, (c_ubyte * len(seed))(*seed), key)
+    return bytes(key)
+
+
+def _per_call(fn, runs):
+    return min(timeit.repeat(fn, number=runs, repeat=5)) / runs
+
+
+def _report(name, old, new):
+    print(f"{name:<22} {old * 1e6:9.2f} us -> {new * 1e6:9.2f} us  x{old / new:,.1f}")
+
+
+def exchange_latency(rounds):
+    """Seconds per 0x27 request-seed / compute-key / send-key exchange."""
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()), VirtualEcu(
+        channel=CHANNEL
+    ), FlashSession(interface="virtual", channel=CHANNEL, trace=False) as session:
+        uds = session.uds
+        algorithm = aes_seed_key()
+        for _ in range(rounds):
+            t = time.perf_counter()
+            seed = uds.request_seed(0x03)
+            if not seed or not uds.send_key(algorithm.key(bytes(seed), 0x03), 0x03):
+                raise SystemExit("[FAIL] Security access against the virtual ECU failed")
+            samples.append(time.perf_counter() - t)
+    return samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dll", help="supplier SedKeyGen DLL (skipped if not given)")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    seed = os.urandom(16)
+    algorithm = aes_seed_key()
+    if algorithm.key(seed, 0x03) != encrypt_seed_uncached(seed, 3):
+        raise SystemExit("[FAIL] cached AES key differs")
+    _report(
+        "AES key",
+        _per_call(lambda: encrypt_seed_uncached(seed, 3), 2000),
+        _per_call(lambda: algorithm.key(seed, 0x03), 2000),
+    )
+
+    if args.dll:
+        dll = dll_seed_key(args.dll)
+        if dll.key(seed, 1) != dll_key_uncached(seed, args.dll):
+            raise SystemExit("[FAIL] cached DLL key differs")
+        _report(
+            "DLL key",
+            _per_call(lambda: dll_key_uncached(seed, args.dll), 200),
+            _per_call(lambda: dll.key(seed, 1), 2000),
+        )
+    else:
+        print("DLL key                skipped (no --dll)")
+
+    ms = sorted(s * 1e3 for s in exchange_latency(args.rounds))
+    print(
+        f"0x27 seed->key exchange p50 {ms[len(ms) // 2]:.3f} ms  "
+        f"mean {statistics.fmean(ms):.3f} ms  max {ms[-1]:.3f} ms (virtual bus)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+TransferData loop benchmark on a python-can virtual bus: the gap between the
+ECU's 0x76 response and the tester's next First Frame, for the original
+flash_chunk loop (frame and send each request after the last 0x76, one
+print per chunk) and for the current one (requests framed into a
+prepared buffer by transfer_data(), no per-chunk print). stdout is
+captured, as the GUI redirects it.
+
+    python -m benchmarks.bench_transfer [block_bytes] [max_block_length]
+"""
+
+import contextlib
+import io
+import os
+import statistics
+import sys
+import threading
+import time
+
+import can
+
+from Flashing.flash_chunk import flash_chunk
+from Flashing.flash_session import FlashSession
+from Flashing.segment_image import SegmentImage
+
+CHANNEL = "bench_transfer"
+TX_ID, RX_ID = 0x7E0, 0x7E8
+
+
+class _Responder(threading.Thread):
+    """Minimal bootloader side: FC for every FF, 0x76 after the last CF."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.bus = can.Bus(interface="virtual", channel=CHANNEL)
+        self.running = True
+        self.received = bytearray()
+
+    def send(self, data):
+        data = bytes(data) + bytes(8 - len(data))
+        self.bus.send(can.Message(arbitration_id=RX_ID, data=data, is_extended_id=False))
+
+    def run(self):
+        remaining = 0
+        payload = bytearray()
+        while self.running:
+            msg = self.bus.recv(0.1)
+            if not msg or msg.arbitration_id != TX_ID:
+                continue
+            d = msg.data
+            pci = d[0] >> 4
+            if pci == 0x1:
+                total = ((d[0] & 0x0F) << 8) | d[1]
+                payload = bytearray(d[2:8])
+                remaining = total - 6
+                self.send([0x30, 0x00, 0x00])
+            elif pci == 0x2 and remaining > 0:
+                take = min(7, remaining)
+                payload += d[1 : 1 + take]
+                remaining -= take
+                if remaining == 0:
+                    self.received += payload[2:]
+                    self.send([0x02, 0x76, payload[1]])
+            elif pci == 0x0:
+                self.send([0x02, d[1] + 0x40, d[2]])
+
+
+class _Sniffer(can.Listener):
+    """Records timestamps of 0x76 responses and of the next First Frame."""
+
+    def __init__(self):
+        self.gaps = []
+        self._last_resp = None
+
+    def on_message_received(self, msg):
+        d = msg.data
+        if msg.arbitration_id == RX_ID and d[0] == 0x02 and d[1] == 0x76:
+            self._last_resp = msg.timestamp
+        elif msg.arbitration_id == TX_ID and d[0] >> 4 == 0x1 and self._last_resp:
+            self.gaps.append(msg.timestamp - self._last_resp)
+            self._last_resp = None
+
+
+def original_loop(session, image, start, length, capacity):
+    """flash_chunk's TransferData loop before the prepared-buffer change."""
+    seq = 1
+    print("HHH")
+    for chunk in image.iter_chunks(start, length, capacity):
+        session.keep_alive()
+        if not session.uds.transfer_data(seq, chunk):
+            raise SystemExit(f"[FAIL] TransferData failed at seq=0x{seq:02X}")
+        print("IIII")
+        yield True
+        seq = 0 if seq == 0xFF else (seq + 1)
+
+
+def current_loop(session, image, start, length, capacity):
+    for step in flash_chunk(image, start, length, capacity, session=session):
+        if step is not True and not (isinstance(step, tuple) and step[1]):
+            raise SystemExit("[FAIL] flash_chunk failed")
+        yield step
+
+
+def run(loop, image, start, length, capacity):
+    ecu = _Responder()
+    ecu.start()
+    sniffer_bus = can.Bus(interface="virtual", channel=CHANNEL)
+    sniffer = _Sniffer()
+    notifier = can.Notifier(sniffer_bus, [sniffer])
+    session = FlashSession(interface="virtual", channel=CHANNEL, trace=False)
+    try:
+        with session, contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            for _ in loop(session, image, start, length, capacity):
+                pass
+            elapsed = time.perf_counter() - t0
+        time.sleep(0.05)
+    finally:
+        notifier.stop()
+        sniffer_bus.shutdown()
+        ecu.running = False
+        ecu.join()
+        ecu.bus.shutdown()
+    if bytes(ecu.received) != b"".join(image.iter_chunks(start, length, 1 << 16)):
+        raise SystemExit("[FAIL] ECU received different data")
+    return elapsed, sniffer.gaps
+
+
+def main(size: int = 25014, max_block_length: int = 0x82):
+    image = SegmentImage()
+    image.write(0xFF200080, os.urandom(size))
+    capacity = max_block_length - 2
+    print(f"block: {size} bytes, {capacity} bytes per TransferData")
+    for name, loop in (("original", original_loop), ("current", current_loop)):
+        elapsed, gaps = run(loop, image, 0xFF200080, size, capacity)
+        gaps_us = sorted(g * 1e6 for g in gaps)
+        p95 = gaps_us[int(len(gaps_us) * 0.95) - 1] if gaps_us else 0.0
+        print(
+            f"{name:<10} total {elapsed * 1e3:8.1f} ms  "
+            f"0x76->FF gap median {statistics.median(gaps_us):7.1f} us  "
+            f"p95 {p95:7.1f} us  ({len(gaps_us)} requests)"
+        )
+
+
+if __name__ == "__main__":
+    args = [int(a, 0) for a in sys.argv[1:3]]
+    main(*args)